@@ -23,7 +23,11 @@
     doing auto tests with Selenium Python bindings.
 """
 
-from .console_capture import captureConsole
+from .console_capture import captureConsole, readRecording
+from .console_capture import ConsoleCaptureCollector, ConsoleCapturePool, ConsoleCaptureRecorder
+from .console_capture import ConsoleCaptureEntries, ConsoleCaptureEntry
+from .console_capture import ConsoleCaptureAccessor, AsyncConsoleCaptureAccessor
 del console_capture
 
-__all__ = ['captureConsole']
+__all__ = ['captureConsole', 'readRecording', 'ConsoleCaptureCollector', 'ConsoleCapturePool', 'ConsoleCaptureRecorder',
+           'ConsoleCaptureEntries', 'ConsoleCaptureEntry', 'ConsoleCaptureAccessor', 'AsyncConsoleCaptureAccessor']
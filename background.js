@@ -0,0 +1,165 @@
+/* Copyright 2020 Pascal COMBES <pascom@orange.fr>
+ * 
+ * This file is part of ConsoleCapture.
+ * 
+ * ConsoleCapture is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ * 
+ * ConsoleCapture is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ * 
+ * You should have received a copy of the GNU General Public License
+ * along with ConsoleCapture. If not, see <http://www.gnu.org/licenses/>
+ */
+
+/*!
+ * \brief Configuration shared by all the documents
+ *
+ * The content scripts get it when they are loaded
+ * and are notified when it changes.
+ *  - `push`: The URL to which the captured calls are pushed (or `null`),
+ *  - `persist`: The number of captured calls kept for each tab
+ *    across navigations (`0` disables it),
+ *  - `targets`: The paths of the other functions of the pages to capture.
+ */
+var config = {
+    push: null,
+    persist: 0,
+    targets: [],
+};
+
+/*!
+ * \brief Captured calls kept for each tab
+ *
+ * Maps the id of the tab to the list of the calls captured in it,
+ * tagged with the URL of the page in which they were captured.
+ */
+var histories = new Map();
+
+/*!
+ * \brief Last call kept for each document of each tab
+ *
+ * Maps the id of the tab to a map from the documents to their last call,
+ * which is sent again when coalesced calls update it.
+ */
+var lastEntries = new Map();
+
+/*!
+ * \brief Send the configuration to all the documents
+ */
+function broadcast()
+{
+    browser.tabs.query({}).then((tabs) => {
+        tabs.forEach((tab) => {
+            browser.tabs.sendMessage(tab.id, {type: 'config', config: config}).catch(() => {});
+        });
+    });
+}
+
+/*!
+ * \brief Keep captured calls in the history of the tab
+ *
+ * \param sender The sender of the captured calls.
+ * \param document The document in which the calls were captured.
+ * \param entries The captured calls (as a JSON string).
+ */
+function persist(sender, document, entries)
+{
+    var history = histories.get(sender.tab.id);
+    if (history === undefined)
+        histories.set(sender.tab.id, history = []);
+    var lasts = lastEntries.get(sender.tab.id);
+    if (lasts === undefined)
+        lastEntries.set(sender.tab.id, lasts = new Map());
+
+    JSON.parse(entries).forEach((entry) => {
+        entry.url = sender.url;
+        var last = lasts.get(document);
+        // A coalesced call is updated in place:
+        if ((last !== undefined) && (last.seq === entry.seq)) {
+            Object.assign(last, entry);
+            return;
+        }
+        history.push(entry);
+        lasts.set(document, entry);
+    });
+    if (history.length > config.persist)
+        history.splice(0, history.length - config.persist);
+}
+
+/*!
+ * \brief Last push to the collector
+ *
+ * The pushes are chained, so that the collector receives them in order.
+ */
+var pushing = Promise.resolve();
+
+/*!
+ * \brief Push captured calls to the collector
+ *
+ * \param sender The sender of the captured calls.
+ * \param entries The captured calls (as a JSON string).
+ */
+function push(sender, entries)
+{
+    var url = config.push;
+    var body = '{"tab":' + JSON.stringify(sender.tab.id) + ',"url":' + JSON.stringify(sender.url) + ',"entries":' + entries + '}';
+    pushing = pushing.then(() => fetch(url, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: body,
+    })).catch((e) => console.error("ConsoleCapture could not push to " + url + ": " + e));
+}
+
+/*!
+ * \brief Gather the captures of all the frames of a tab
+ *
+ * \param tabId The id of the tab.
+ * \return A promise resolved with the list of the captures of the frames
+ * (with keys `frameId`, `url` and `entries`, as a JSON string).
+ */
+function frames(tabId)
+{
+    return browser.webNavigation.getAllFrames({tabId: tabId}).then((frames) => {
+        return Promise.all(frames.map((frame) => {
+            return browser.tabs.sendMessage(tabId, {type: 'get'}, {frameId: frame.frameId}).then((capture) => {
+                return {frameId: frame.frameId, url: capture.url, entries: capture.entries};
+            }, () => null); // No capture in this frame
+        }));
+    }).then((captures) => captures.filter((capture) => capture !== null));
+}
+
+browser.tabs.onRemoved.addListener((tabId) => {
+    histories.delete(tabId);
+    lastEntries.delete(tabId);
+});
+
+browser.runtime.onMessage.addListener((message, sender) => {
+    switch (message.type) {
+    case 'config':
+        return Promise.resolve(config);
+    case 'configure':
+        Object.assign(config, message.config);
+        broadcast();
+        return Promise.resolve(config);
+    case 'entries':
+        if (config.push !== null)
+            push(sender, message.entries);
+        if (config.persist > 0)
+            persist(sender, message.document, message.entries);
+        break;
+    case 'history':
+        var history = histories.get(sender.tab.id) || [];
+        if (message.clear) {
+            histories.delete(sender.tab.id);
+            lastEntries.delete(sender.tab.id);
+        }
+        return Promise.resolve(history);
+    case 'frames':
+        return frames(sender.tab.id);
+    }
+});
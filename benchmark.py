@@ -0,0 +1,421 @@
+# Copyright 2020 Pascal COMBES <pascom@orange.fr>
+#
+# This file is part of ConsoleCapture.
+#
+# ConsoleCapture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ConsoleCapture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ConsoleCapture. If not, see <http://www.gnu.org/licenses/>
+
+"""
+    Benchmarks of **ConsoleCapture**
+
+    The number of WebDriver round trips of each operation of the Python
+    wrapper is checked against a ``FakeWebDriver``, which needs no browser::
+
+        python -m unittest benchmark
+
+    The overhead of the capture in the page and the latency of the retrieval
+    are measured in headless Firefox, with ``dist/console_capture.xpi``::
+
+        python benchmark.py --shapes scalar object --sizes 10 100 --depths 0 2
+"""
+
+from selenium import webdriver
+
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.dirname(__file__))
+
+from PythonUtils.testdata import TestData
+from console_capture import captureConsole
+
+class FakeWebDriver:
+    """
+        In-process WebDriver counting the round trips
+
+        Emulates the part of **ConsoleCapture** in the page on which the
+        Python wrapper relies (the guarded scripts and the readiness event),
+        so that the round trips of the wrapper can be counted without a browser.
+        Each round trip is kept in ``calls``, as a tuple with the Selenium
+        method, the ``console.capture`` member used by the script and the
+        time spent (in seconds).
+
+        *Parameters*:
+            - **latency**: The time (in seconds) each round trip takes.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.entries = []
+        self.calls = []
+        self.__seq = 0
+        self.__document = 0
+        self.__ready = True
+
+    @property
+    def roundTrips(self):
+        """
+            The number of round trips since the last reset
+        """
+        return len(self.calls)
+
+    def reset(self):
+        """
+            Forget the round trips
+        """
+        self.calls = []
+
+    def log(self, *args):
+        """
+            Capture a call to ``console.log()`` in the page
+
+            *Parameters*:
+                - **args**: The arguments of the call.
+        """
+        self.entries.append({'seq': self.__seq, 'callee': 'log', 'time': int(time.time() * 1000), 'arguments': list(args)})
+        self.__seq += 1
+
+    def navigate(self):
+        """
+            Load a new document, where **ConsoleCapture** is not ready yet
+        """
+        self.entries = []
+        self.__seq = 0
+        self.__document += 1
+        self.__ready = False
+
+    def install_addon(self, path, temporary=False):
+        return 'console_capture@pas.com'
+
+    def __member(self, script):
+        members = re.findall(r'console\.capture\.(\w+)', script)
+        # The guard reads console.capture.document first:
+        members = [m for m in members if m != 'document']
+        return members[0] if members else None
+
+    def __value(self, member, args):
+        if member in ('get', 'query', 'history', 'frames'):
+            # The cursor of tail() only applies to the same document:
+            since = args[0] if (member == 'get') and (len(args) == 3) and (args[1] == str(self.__document)) else 0
+            return [e for e in self.entries if e['seq'] >= since]
+        if member == 'drain':
+            entries, self.entries = self.entries, []
+            return entries
+        if member == 'clear':
+            self.entries = []
+        if member in ('status', 'configure', 'stats'):
+            return {'length': len(self.entries), 'seq': self.__seq}
+        if member == 'counters':
+            return []
+        return 0
+
+    def __roundTrip(self, method, script, args):
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        member = self.__member(script)
+        if 'consolecaptureready' in script:
+            self.__ready = True
+            result = True
+        elif not self.__ready:
+            result = None
+        else:
+            result = [str(self.__document), self.__value(member, args)]
+        self.calls.append((method, member, time.perf_counter() - start))
+        return result
+
+    def execute_script(self, script, *args):
+        return self.__roundTrip('execute_script', script, args)
+
+    def execute_async_script(self, script, *args):
+        return self.__roundTrip('execute_async_script', script, args)
+
+class TestCase(type):
+    __testCaseList = []
+
+    @classmethod
+    def loadTests(metacls, loader, tests, pattern):
+        suite = unittest.TestSuite()
+        for cls in metacls.__testCaseList:
+            tests = loader.loadTestsFromTestCase(cls)
+            suite.addTests(tests)
+        return suite
+
+    def __new__(metacls, *args):
+        cls = super().__new__(metacls, *args)
+        metacls.__testCaseList += [cls]
+        return cls
+
+def load_tests(loader, tests, pattern):
+    return TestCase.loadTests(loader, tests, pattern)
+
+def setDepth(capture):
+    capture.depth = 1
+
+class RoundTripTest(unittest.TestCase, metaclass=TestCase):
+    def setUp(self):
+        self.browser = FakeWebDriver()
+        captureConsole(self.browser, 'dist/console_capture.xpi')
+        self.browser.log('1')
+        self.browser.reset()
+
+    @TestData([
+        {'operation': lambda c: c(),                       'roundTrips': 1},
+        {'operation': lambda c: c(compact=True),           'roundTrips': 1},
+        {'operation': lambda c: c(lazy=True),              'roundTrips': 1},
+        {'operation': lambda c: c.tail(),                  'roundTrips': 1},
+        {'operation': lambda c: c.drain(),                 'roundTrips': 1},
+        {'operation': lambda c: c.clear(),                 'roundTrips': 1},
+        {'operation': lambda c: c.depth,                   'roundTrips': 1},
+        {'operation': setDepth,                            'roundTrips': 1},
+        {'operation': lambda c: c.configure(depth=1, capacity=10), 'roundTrips': 1},
+        {'operation': lambda c: c.status(),                'roundTrips': 1},
+        {'operation': lambda c: c.stats(reset=True),       'roundTrips': 1},
+        {'operation': lambda c: c.counters(),              'roundTrips': 1},
+        {'operation': lambda c: c.query(callee='log'),     'roundTrips': 1},
+        {'operation': lambda c: c.frames(),                'roundTrips': 1},
+        {'operation': lambda c: c.history(),               'roundTrips': 1},
+    ])
+    def testRoundTrips(self, operation, roundTrips):
+        self.browser.reset()
+        operation(self.browser.consoleCapture)
+        self.assertEqual(self.browser.roundTrips, roundTrips)
+
+    def testDelete(self):
+        del self.browser.consoleCapture
+        self.assertEqual(self.browser.roundTrips, 1)
+
+    def testTail(self):
+        self.assertEqual(len(self.browser.consoleCapture.tail()), 1)
+        self.browser.log('2')
+        self.assertEqual(len(self.browser.consoleCapture.tail()), 1)
+        self.assertEqual(len(self.browser.consoleCapture.tail()), 0)
+        self.assertEqual(self.browser.roundTrips, 3)
+
+    def testNavigation(self):
+        self.browser.navigate()
+        self.assertEqual(self.browser.consoleCapture(), [])
+        # Guarded script, wait for the capture and guarded script again:
+        self.assertEqual(self.browser.roundTrips, 3)
+        self.browser.reset()
+        self.browser.consoleCapture()
+        self.assertEqual(self.browser.roundTrips, 1)
+
+    def testAsync(self):
+        asyncio.run(self.browser.asyncConsoleCapture())
+        self.assertEqual(self.browser.roundTrips, 1)
+
+# Javascript expressions of the arguments, as functions of the size n:
+SHAPES = {
+    'scalar': "n",
+    'string': "'x'.repeat(n)",
+    'array':  "Array.from({length: n}, (v, k) => k)",
+    'object': "Object.fromEntries(Array.from({length: n}, (v, k) => ['key' + k, k]))",
+    'nested': "(function nest(d) { return (d == 0) ? {} : {child: nest(d - 1)}; })(n)",
+}
+
+def benchmarkOverhead(browser, shapes, sizes, depths, count):
+    """
+        Measure the overhead of the capture for each call
+
+        The same calls are made with and without capture in the page.
+
+        *Parameters*:
+            - **browser**: The Selenium WebDriver in which **ConsoleCapture** is installed.
+            - **shapes**: The names of the shapes of the arguments (see ``SHAPES``).
+            - **sizes**: The sizes of the arguments.
+            - **depths**: The capture depths.
+            - **count**: The number of calls.
+
+        *Returns*: The list of the results.
+    """
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            for depth in depths:
+                browser.consoleCapture.configure(depth=depth, capacity=0)
+                browser.consoleCapture.stats(reset=True)
+                original, captured = browser.execute_script(f"""
+                    var n = arguments[0];
+                    var arg = {SHAPES[shape]};
+                    var start = performance.now();
+                    for (var i = 0; i < arguments[1]; i++)
+                        console.original.log(arg);
+                    var original = performance.now() - start;
+                    start = performance.now();
+                    for (var i = 0; i < arguments[1]; i++)
+                        console.log(arg);
+                    return [original, performance.now() - start];
+                """, size, count)
+                stats = browser.consoleCapture.stats()
+                del browser.consoleCapture
+                results.append({
+                    'shape': shape,
+                    'size': size,
+                    'depth': depth,
+                    'overhead': 1000 * (captured - original) / count,
+                    'clean': 1000 * stats['clean']['total'] / max(stats['clean']['count'], 1),
+                    'stack': 1000 * stats['stack']['total'] / max(stats['stack']['count'], 1),
+                    'bytes': stats['bytes'] / count,
+                })
+    return results
+
+def benchmarkRetrieval(browser, shapes, sizes, lengths, repeat):
+    """
+        Measure the latency of the retrieval of the capture
+
+        *Parameters*:
+            - **browser**: The Selenium WebDriver in which **ConsoleCapture** is installed.
+            - **shapes**: The names of the shapes of the arguments (see ``SHAPES``).
+            - **sizes**: The sizes of the arguments.
+            - **lengths**: The numbers of calls in the capture.
+            - **repeat**: The number of retrievals to average (the median is kept).
+
+        *Returns*: The list of the results.
+    """
+    results = []
+    browser.consoleCapture.configure(depth=0, capacity=0)
+    for shape in shapes:
+        for size in sizes:
+            for length in lengths:
+                del browser.consoleCapture
+                browser.execute_script(f"""
+                    var n = arguments[0];
+                    var arg = {SHAPES[shape]};
+                    for (var i = 0; i < arguments[1]; i++)
+                        console.log(arg);
+                """, size, length)
+                result = {'shape': shape, 'size': size, 'length': length}
+                for name, options in [('get', {}), ('compact', {'compact': True}), ('lazy', {'lazy': True})]:
+                    times = []
+                    for r in range(repeat):
+                        start = time.perf_counter()
+                        browser.consoleCapture(**options)
+                        times.append(1000 * (time.perf_counter() - start))
+                    result[name] = statistics.median(times)
+                browser.consoleCapture.tail()
+                start = time.perf_counter()
+                browser.consoleCapture.tail()
+                result['emptyTail'] = 1000 * (time.perf_counter() - start)
+                results.append(result)
+    del browser.consoleCapture
+    return results
+
+def benchmarkRate(browser, shape, size, rates, duration, interval):
+    """
+        Measure the latency of ``tail()`` while the page logs
+
+        *Parameters*:
+            - **browser**: The Selenium WebDriver in which **ConsoleCapture** is installed.
+            - **shape**: The name of the shape of the arguments (see ``SHAPES``).
+            - **size**: The size of the arguments.
+            - **rates**: The numbers of calls per second.
+            - **duration**: The duration of each measurement (in seconds).
+            - **interval**: The time between two calls to ``tail()`` (in seconds).
+
+        *Returns*: The list of the results.
+    """
+    results = []
+    for rate in rates:
+        del browser.consoleCapture
+        browser.consoleCapture.tail()
+        browser.consoleCapture.stats(reset=True)
+        browser.execute_script(f"""
+            var n = arguments[0];
+            var arg = {SHAPES[shape]};
+            var perTick = arguments[1] / 100;
+            var due = 0;
+            window.benchmarkTimer = setInterval(() => {{
+                for (due += perTick; due >= 1; due--)
+                    console.log(arg);
+            }}, 10);
+        """, size, rate)
+        times = []
+        retrieved = 0
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            retrieved += len(browser.consoleCapture.tail())
+            times.append(1000 * (time.perf_counter() - start))
+            time.sleep(interval)
+        browser.execute_script("clearInterval(window.benchmarkTimer);")
+        retrieved += len(browser.consoleCapture.tail())
+        stats = browser.consoleCapture.stats()
+        results.append({
+            'rate': rate,
+            'calls': stats['calls'],
+            'retrieved': retrieved,
+            'dropped': stats['dropped'],
+            'tail': statistics.mean(times),
+            'maxTail': max(times),
+        })
+    del browser.consoleCapture
+    return results
+
+def printResults(title, results):
+    print(title)
+    if len(results) == 0:
+        return
+    keys = list(results[0].keys())
+    print('\t'.join(keys))
+    for result in results:
+        print('\t'.join(f"{result[k]:.3f}" if isinstance(result[k], float) else str(result[k]) for k in keys))
+    print()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ConsoleCapture in headless Firefox.")
+    parser.add_argument('--xpi', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dist/console_capture.xpi'),
+                        help="The path to ConsoleCapture extension file.")
+    parser.add_argument('--shapes', nargs='+', default=list(SHAPES.keys()), choices=list(SHAPES.keys()),
+                        help="The shapes of the arguments.")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 100],
+                        help="The sizes of the arguments.")
+    parser.add_argument('--depths', nargs='+', type=int, default=[0, 1, 3],
+                        help="The capture depths.")
+    parser.add_argument('--count', type=int, default=1000,
+                        help="The number of calls to measure the overhead.")
+    parser.add_argument('--lengths', nargs='+', type=int, default=[100, 1000, 10000],
+                        help="The numbers of calls in the capture to measure the retrieval.")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="The number of retrievals to average.")
+    parser.add_argument('--rates', nargs='+', type=int, default=[100, 1000, 10000],
+                        help="The numbers of calls per second while tailing.")
+    parser.add_argument('--duration', type=float, default=2,
+                        help="The duration of each tailing measurement (in seconds).")
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help="The time between two calls to tail() (in seconds).")
+    args = parser.parse_args(argv)
+
+    options = webdriver.FirefoxOptions()
+    options.add_argument('-headless')
+    browser = webdriver.Firefox(options=options)
+    try:
+        captureConsole(browser, args.xpi)
+        browser.get('file://' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test/index.html'))
+
+        printResults("Overhead per call (us) and size per call (bytes)",
+                     benchmarkOverhead(browser, args.shapes, args.sizes, args.depths, args.count))
+        printResults("Retrieval latency (ms)",
+                     benchmarkRetrieval(browser, args.shapes, args.sizes, args.lengths, args.repeat))
+        printResults("Tail latency while logging (ms)",
+                     benchmarkRate(browser, args.shapes[0], args.sizes[0], args.rates, args.duration, args.interval))
+    finally:
+        browser.quit()
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,141 @@
  * along with ConsoleCapture. If not, see <http://www.gnu.org/licenses/>
  */
 
+/*!
+ * \brief Buffer of captured calls
+ *
+ * Stores the captured calls in order.
+ * When a capacity is set (in number of calls with `capacity`
+ * and/or in approximate size in bytes with `maxBytes`)
+ * the calls are stored in a fixed-size ring buffer
+ * and the overflow policy decides what to do when it is full:
+ *  - `oldest`: The oldest calls are dropped to make room for the new ones,
+ *  - `newest`: The new calls are dropped,
+ *  - `stop`: The capture stops until the buffer is cleared.
+ * The number of dropped calls is counted in `dropped`
+ * and the approximate size of the stored calls in `bytes`.
+ */
+class CaptureBuffer
+{
+    constructor()
+    {
+        this.capacity = 0;
+        this.maxBytes = 0;
+        this.overflow = 'oldest';
+        this.dropped = 0;
+        this.clear();
+    }
+
+    clear()
+    {
+        this.entries = (this.capacity > 0) ? new Array(this.capacity) : [];
+        this.sizes = (this.capacity > 0) ? new Array(this.capacity) : [];
+        this.head = 0;
+        this.length = 0;
+        this.bytes = 0;
+        this.stopped = false;
+    }
+
+    index(i)
+    {
+        return (this.capacity > 0) ? (this.head + i) % this.capacity : this.head + i;
+    }
+
+    at(i)
+    {
+        return this.entries[this.index(i)];
+    }
+
+    slice(from)
+    {
+        var entries = [];
+        for (var i = from; i < this.length; i++)
+            entries.push(this.at(i));
+        return entries;
+    }
+
+    search(seq)
+    {
+        var lo = 0;
+        var hi = this.length;
+        while (lo < hi) {
+            var mid = (lo + hi) >> 1;
+            if (this.at(mid).seq < seq)
+                lo = mid + 1;
+            else
+                hi = mid;
+        }
+        return lo;
+    }
+
+    isFull(size)
+    {
+        if ((this.capacity > 0) && (this.length >= this.capacity))
+            return true;
+        return (this.maxBytes > 0) && (this.length > 0) && (this.bytes + size > this.maxBytes);
+    }
+
+    push(entry, size)
+    {
+        while (this.isFull(size)) {
+            if (this.overflow != 'oldest') {
+                this.stopped = (this.overflow == 'stop');
+                this.dropped++;
+                return false;
+            }
+            this.shift();
+            this.dropped++;
+        }
+
+        var i = this.index(this.length);
+        this.entries[i] = entry;
+        this.sizes[i] = size;
+        this.length++;
+        this.bytes += size;
+        return true;
+    }
+
+    resizeEntry(i, size)
+    {
+        this.bytes += size - this.sizes[this.index(i)];
+        this.sizes[this.index(i)] = size;
+    }
+
+    shift()
+    {
+        var i = this.index(0);
+        var entry = this.entries[i];
+        this.bytes -= this.sizes[i];
+        this.entries[i] = undefined;
+        this.sizes[i] = undefined;
+        this.length--;
+
+        if (this.capacity > 0) {
+            this.head = (this.head + 1) % this.capacity;
+        } else if (++this.head >= this.length) {
+            // Compact the storage when it is mostly empty:
+            this.entries = this.entries.slice(this.head);
+            this.sizes = this.sizes.slice(this.head);
+            this.head = 0;
+        }
+        return entry;
+    }
+
+    resize(capacity, maxBytes)
+    {
+        var entries = this.slice(0);
+        var sizes = entries.map((e, i) => this.sizes[this.index(i)]);
+        var overflow = this.overflow;
+
+        this.capacity = capacity;
+        this.maxBytes = maxBytes;
+        this.overflow = 'oldest';
+        this.clear();
+        entries.forEach((e, i) => this.push(e, sizes[i]));
+        this.overflow = overflow;
+    }
+}
+
 /*!
  * \brief Capture calls to an object
  *
@@ -23,107 +158,995 @@
  * The object must be a children of window object
  * and all its members MUST be functions.
  * The original functions are still available using `.original`
+ * The capture is read and configured through the methods and the settings
+ * of `.capture`, which are described where they are defined.
+ *
+ * Each captured call has a sequence number (`seq`), the name of the member
+ * (`callee`), its time, its start time (`start`, as given by
+ * `performance.now()`), its duration in milliseconds (`duration`, until its
+ * result settles when it is a promise, which the pushed calls may miss),
+ * its call site and its serialized arguments, where:
+ *  - Objects referenced several times (including cyclic references) are
+ *    serialized once, the other references being replaced by `{$ref: path}`,
+ *    where `path` is the list of the keys leading to the first occurrence,
+ *  - Truncated strings are replaced by `{$truncated: 'String', size, value}`,
+ *    truncated arrays end with `{$truncated: 'Array', size}` and truncated
+ *    objects have a `$truncated` key with their original number of keys,
+ *  - The keys of the page objects starting with `$` are escaped with another `$`.
  * \param objName The name of the object to capture.
  */
 function capture(objName)
 {
-    var captured = [];
+    var captured = new CaptureBuffer();
+    var captureSeq = 0;
+    var captureDocument = Math.random().toString(36).slice(2) + Date.now().toString(36);
     var captureDepth = 0;
+    var captureLimits = {maxString: 0, maxArray: 0, maxKeys: 0, maxEntryBytes: 0};
+    var captureStack = 'full';
+    var captureMode = 'entries';
+    var captureCoalesce = false;
+    var captureDefer = false;
+    var capturePush = null;
+    var capturePersist = 0;
+    var captureTargets = [];
+    var configured = false;
+    var captureFilters = {spec: null, allow: null, deny: null, fileName: null, prefix: null};
+    var pushed = [];
+    var pushTimer = null;
 
     function isA(value, typeName)
     {
         return Object.prototype.toString.call(value) == '[object ' + typeName + ']'
     }
 
-    function clean(value, level)
+    function clean(value)
     {
-        if (arguments.length == 1)
-            level = 0;
+        // Objects already visited, with their path from the root:
+        var seen = new WeakMap();
+        var path = [];
+        // Approximate size of the serialized value:
+        var bytes = 0;
 
-        if (isA(value, 'Arguments')) {
-            return Array.prototype.map.call(value, (v) => clean(v, level));
-        } else if (isA(value, 'Array')) {
-            return value.map((v) => clean(v, level));
-        } else if (isA(value, 'Boolean') || isA(value, 'Number') || isA(value, 'String')) {
-            return value;
-        } else if (value === null) {
-            return 'null';
-        } else if (value === undefined) {
-            return 'undefined';
-        } else if (isA(value, 'Function')) {
-            return 'function()';
-        } else if (isA(value, 'Object')) {
-            var cleanValue = {};
-            Object.keys(value).forEach((key) => {
-                cleanValue[key] = clean(value[key], level);
-            });
+        function full(count, limit)
+        {
+            if ((limit > 0) && (count >= limit))
+                return true;
+            return (captureLimits.maxEntryBytes > 0) && (bytes >= captureLimits.maxEntryBytes);
+        }
+
+        function string(value)
+        {
+            var limit = Infinity;
+            if (captureLimits.maxString > 0)
+                limit = captureLimits.maxString;
+            if (captureLimits.maxEntryBytes > 0)
+                limit = Math.max(0, Math.min(limit, captureLimits.maxEntryBytes - bytes - 2));
+            if (value.length <= limit) {
+                bytes += value.length + 2;
+                return value;
+            }
+            bytes += limit + 2;
+            return {'$truncated': 'String', size: value.length, value: value.slice(0, limit)};
+        }
+
+        function visit(value)
+        {
+            // Primitives (like BigInt or Symbol) cannot be WeakMap keys:
+            if ((typeof value == 'object') && (value !== null))
+                seen.set(value, path.slice());
+        }
+
+        function escape(key)
+        {
+            // The keys starting with $ are reserved for the markers ($ref, $truncated):
+            return (key[0] == '$') ? '$' + key : key;
+        }
+
+        function child(value, key, level)
+        {
+            path.push(key);
+            var cleanValue = walk(value, level);
+            path.pop();
             return cleanValue;
-        } else if (isA(value, 'Error')) {
-            return {
-                type: 'Error',
-                lineNumber: value.lineNumber,
-                columnNumber: value.columnNumber,
-                fileName: value.fileName,
-            };
-        } else {
-            if ((value.nodeType == 1) && value.tagName)
+        }
+
+        function walk(value, level)
+        {
+            if ((typeof value == 'object') && (value !== null) && seen.has(value))
+                return {'$ref': seen.get(value)};
+
+            if (isA(value, 'Arguments') || isA(value, 'Array')) {
+                visit(value);
+                var items = [];
+                // The arguments themselves are only bounded by the size of the call:
+                var limit = (path.length == 0) ? 0 : captureLimits.maxArray;
+                for (var i = 0; (i < value.length) && !full(i, limit); i++)
+                    items.push(child(value[i], i, level));
+                if (items.length < value.length)
+                    items.push({'$truncated': 'Array', size: value.length});
+                return items;
+            } else if (isA(value, 'String')) {
+                return string(value);
+            } else if (isA(value, 'Boolean') || isA(value, 'Number')) {
+                bytes += String(value).length;
                 return value;
-            if (level >= captureDepth)
+            } else if (value === null) {
+                return 'null';
+            } else if (value === undefined) {
+                return 'undefined';
+            } else if (isA(value, 'Function')) {
+                return 'function()';
+            } else if (isA(value, 'Object')) {
+                visit(value);
+                var cleanValue = {};
+                var keys = Object.keys(value);
+                for (var k = 0; (k < keys.length) && !full(k, captureLimits.maxKeys); k++) {
+                    var key = escape(keys[k]);
+                    bytes += key.length + 4;
+                    cleanValue[key] = child(value[keys[k]], key, level);
+                }
+                if (k < keys.length)
+                    cleanValue['$truncated'] = keys.length;
+                return cleanValue;
+            } else if (isA(value, 'Error')) {
+                visit(value);
+                return {
+                    type: 'Error',
+                    lineNumber: value.lineNumber,
+                    columnNumber: value.columnNumber,
+                    fileName: value.fileName,
+                };
+            } else {
+                if ((value.nodeType == 1) && value.tagName)
+                    return value;
+                if (level >= captureDepth)
+                    return Object.prototype.toString.call(value);
+
+                visit(value);
+                var cleanValue = {'typeName': Object.prototype.toString.call(value).slice(8, -1)};
+                var count = 0;
+                var kept = 0;
+                for (var property in value) {
+                    if (isA(value[property], 'Function'))
+                        continue;
+
+                    var o = value;
+                    while (!o.hasOwnProperty(property) && !isA(o, 'Object'))
+                        o = Object.getPrototypeOf(o);
+
+                    var desc = Object.getOwnPropertyDescriptor(o, property);
+                    if (!desc.configurable)
+                        continue;
+                    // The properties beyond the limits are only counted:
+                    if (!full(count++, captureLimits.maxKeys)) {
+                        var key = escape(property);
+                        bytes += key.length + 4;
+                        cleanValue[key] = child(value[property], key, level + 1);
+                        kept++;
+                    }
+                }
+                if (kept < count)
+                    cleanValue['$truncated'] = count;
+
+                return cleanValue;
+            }
+        }
+
+        return walk(value, 0);
+    }
+
+    function parseFrame(cap, frame)
+    {
+        var stackLineFields = (/^([^@]*)@(.*):(\d+):(\d+)$/).exec(frame);
+
+        if (stackLineFields !== null) {
+            cap.caller = stackLineFields[1];
+            cap.fileName = stackLineFields[2];
+            cap.lineNumber = stackLineFields[3];
+            cap.columnNumber = stackLineFields[4];
+        }
+    }
+
+    function acceptCall(callee, args)
+    {
+        if ((captureFilters.allow !== null) && !captureFilters.allow.has(callee))
+            return false;
+        if ((captureFilters.deny !== null) && captureFilters.deny.has(callee))
+            return false;
+        if (captureFilters.prefix !== null)
+            return (args.length > 0) && isA(args[0], 'String') && args[0].startsWith(captureFilters.prefix);
+        return true;
+    }
+
+    function acceptFrame(frame)
+    {
+        if (captureFilters.fileName === null)
+            return true;
+        var site = {};
+        parseFrame(site, frame);
+        return (site.fileName !== undefined) && captureFilters.fileName.test(site.fileName);
+    }
+
+    function setFilters(f)
+    {
+        if (f === null) {
+            captureFilters = {spec: null, allow: null, deny: null, fileName: null, prefix: null};
+            return;
+        }
+        if (!isA(f, 'Object'))
+            throw new TypeError("Capture filters must be an object or null");
+
+        var filters = {spec: {}, allow: null, deny: null, fileName: null, prefix: null};
+        Object.keys(f).forEach((name) => {
+            var value = f[name];
+            if ((name == 'allow') || (name == 'deny')) {
+                if (!isA(value, 'Array') || !Array.prototype.every.call(value, (v) => isA(v, 'String')))
+                    throw new TypeError("Capture filter " + name + " must be an array of strings");
+                filters[name] = new Set(value);
+                filters.spec[name] = Array.from(value);
+            } else if ((name == 'fileName') || (name == 'prefix')) {
+                if (!isA(value, 'String'))
+                    throw new TypeError("Capture filter " + name + " must be a string");
+                if (name == 'fileName') {
+                    try {
+                        filters.fileName = new RegExp(value);
+                    } catch (e) {
+                        throw new RangeError("Capture filter fileName is not a valid regular expression: " + value);
+                    }
+                } else {
+                    filters.prefix = value;
+                }
+                filters.spec[name] = value;
+            } else {
+                throw new RangeError("Unknown capture filter " + name);
+            }
+        });
+        captureFilters = filters;
+    }
+
+    // Arguments of the calls whose serialization is deferred:
+    var deferred = new WeakMap();
+    var idleQueue = [];
+    var idleScheduled = false;
+    var idleBatch = 100; // Maximum number of calls serialized in an idle callback
+
+    function position(cap)
+    {
+        var i = captured.search(cap.seq);
+        return ((i < captured.length) && (captured.at(i) === cap)) ? i : -1;
+    }
+
+    function serialize(cap)
+    {
+        var args = deferred.get(cap);
+        if (args === undefined)
+            return;
+        deferred.delete(cap);
+
+        var cleanStart = performance.now();
+        cap.arguments = clean(args);
+        measure(stats.clean, performance.now() - cleanStart);
+
+        // The size is only known now:
+        var i = position(cap);
+        if (i >= 0)
+            captured.resizeEntry(i, sizeOf(cap));
+    }
+
+    function serializeIdle(deadline)
+    {
+        idleScheduled = false;
+        var i = 0;
+        while ((i < idleQueue.length) && (i < idleBatch) && (deadline.didTimeout || (deadline.timeRemaining() > 0))) {
+            var cap = idleQueue[i++];
+            // The calls dropped from the capture are not serialized:
+            if (position(cap) >= 0)
+                serialize(cap);
+            else
+                deferred.delete(cap);
+        }
+        idleQueue.splice(0, i);
+        scheduleIdle();
+    }
+
+    function scheduleIdle()
+    {
+        if (idleScheduled || (idleQueue.length == 0))
+            return;
+        idleScheduled = true;
+        window.requestIdleCallback(serializeIdle, {timeout: 1000});
+    }
+
+    // Call sites captured lazily, parsed when read:
+    var lazyFrames = new WeakMap();
+
+    function resolve(cap)
+    {
+        serialize(cap);
+        var frame = lazyFrames.get(cap);
+        if (frame !== undefined) {
+            parseFrame(cap, frame);
+            lazyFrames.delete(cap);
+        }
+        return cap;
+    }
+
+    function compact(entries)
+    {
+        // Strings repeated from call to call are stored once:
+        var strings = [];
+        var indexes = new Map();
+        function intern(s)
+        {
+            if (!indexes.has(s)) {
+                indexes.set(s, strings.length);
+                strings.push(s);
+            }
+            return indexes.get(s);
+        }
+
+        var columns = {};
+        entries.forEach((entry, i) => {
+            Object.keys(entry).forEach((key) => {
+                if (!(key in columns))
+                    columns[key] = new Array(entries.length).fill(null);
+                if ((key == 'callee') || (key == 'caller') || (key == 'fileName'))
+                    columns[key][i] = intern(entry[key]);
+                else if ((key == 'lineNumber') || (key == 'columnNumber'))
+                    columns[key][i] = Number(entry[key]);
+                else
+                    columns[key][i] = entry[key];
+            });
+        });
+
+        return {length: entries.length, strings: strings, columns: columns};
+    }
+
+    function exportEntries(entries, format)
+    {
+        if ((format !== undefined) && (format !== null) && (format != 'compact') && (format != 'lazy'))
+            throw new RangeError("Capture format must be 'compact', 'lazy' or null");
+
+        entries = entries.map(resolve);
+        if (format == 'lazy') {
+            var capture = compact(entries);
+            capture.format = 'lazy';
+            if ('arguments' in capture.columns)
+                capture.columns.arguments = capture.columns.arguments.map((args) => (args === null) ? null : stringify(args));
+            return cloneInto(capture, window);
+        }
+        if (format == 'compact')
+            return cloneInto(compact(entries), window, {wrapReflectors: true});
+        return cloneInto(entries, window, {wrapReflectors: true});
+    }
+
+    function sizeOf(value)
+    {
+        if (isA(value, 'String'))
+            return value.length + 2;
+        if (isA(value, 'Array'))
+            return value.reduce((s, v) => s + sizeOf(v) + 1, 2);
+        if (isA(value, 'Object'))
+            return Object.keys(value).reduce((s, k) => s + k.length + sizeOf(value[k]) + 4, 2);
+        return String(value).length;
+    }
+
+    function stringify(value)
+    {
+        // DOM elements cannot be serialized:
+        return JSON.stringify(value, (key, value) => {
+            if ((value !== null) && (typeof value == 'object') && (value.nodeType == 1) && value.tagName)
                 return Object.prototype.toString.call(value);
+            return value;
+        });
+    }
 
-            var cleanValue = {'typeName': Object.prototype.toString.call(value).slice(8, -1)};
-            for (property in value) {
-                if (isA(value[property], 'Function'))
-                    continue;
+    function toMessage(entries)
+    {
+        return stringify(entries.map(resolve));
+    }
+
+    function flush()
+    {
+        clearTimeout(pushTimer);
+        pushTimer = null;
+        if (pushed.length == 0)
+            return;
+
+        browser.runtime.sendMessage({type: 'entries', document: captureDocument, entries: toMessage(pushed)});
+        pushed = [];
+    }
+
+    function forwarding()
+    {
+        // Until the configuration is known, the background script decides:
+        return !configured || (capturePush !== null) || (capturePersist > 0);
+    }
 
-                var o = value;
-                while (!o.hasOwnProperty(property) && !isA(o, 'Object'))
-                    o = Object.getPrototypeOf(o);
+    function forward(cap)
+    {
+        pushed.push(cap);
+        if (pushed.length >= 100)
+            flush();
+        else if (pushTimer === null)
+            pushTimer = setTimeout(flush, 100);
+    }
 
-                var desc = Object.getOwnPropertyDescriptor(o, property);
-                if (desc.configurable)
-                    cleanValue[property] = clean(value[property], level + 1);
+    function applyConfig(config)
+    {
+        if ('push' in config)
+            capturePush = config.push;
+        if ('persist' in config)
+            capturePersist = config.persist;
+        if ('targets' in config)
+            setTargets(config.targets, false);
+        configured = true;
+    }
+
+    function getHistory(format, clear, callback)
+    {
+        flush();
+        browser.runtime.sendMessage({type: 'history', clear: clear}).then((history) => {
+            callback(exportEntries(history, format));
+        });
+    }
+
+    browser.runtime.sendMessage({type: 'config'}).then(applyConfig);
+    function gatherFrames(format, callback)
+    {
+        browser.runtime.sendMessage({type: 'frames'}).then((frames) => {
+            var entries = [];
+            frames.forEach((frame) => {
+                JSON.parse(frame.entries).forEach((entry) => {
+                    entry.frame = frame.frameId;
+                    entry.frameUrl = frame.url;
+                    entries.push(entry);
+                });
+            });
+            // The sort is stable, so the calls of a frame stay in order:
+            entries.sort((a, b) => a.time - b.time);
+            callback(exportEntries(entries, format));
+        });
+    }
+
+    browser.runtime.onMessage.addListener((message) => {
+        if (message.type == 'config')
+            applyConfig(message.config);
+        else if (message.type == 'get')
+            return Promise.resolve({url: window.location.href, entries: toMessage(captured.slice(0))});
+    });
+    window.addEventListener('pagehide', flush);
+
+    // Last captured call, with its key for coalescing:
+    var lastCall = {entry: null, key: null};
+
+    function coalesceKey(callee, frame, args)
+    {
+        var comparable = true;
+        var key = JSON.stringify([callee, frame, args], (k, value) => {
+            // DOM elements cannot be compared:
+            if ((value !== null) && (typeof value == 'object') && (value.nodeType == 1) && value.tagName)
+                comparable = false;
+            return value;
+        });
+        return comparable ? key : null;
+    }
+
+    function sameKey(key1, key2)
+    {
+        // Deferred arguments are compared by identity:
+        if (isA(key1, 'Array') && isA(key2, 'Array'))
+            return (key1.length == key2.length) && key1.every((v, i) => v === key2[i]);
+        return (key1 !== null) && (key1 === key2);
+    }
+
+    function coalesce(callee, frame, args, time)
+    {
+        var key = (captureDefer === false) ? coalesceKey(callee, frame, args) : [callee, frame].concat(args);
+        var entry = lastCall.entry;
+        if (sameKey(key, lastCall.key)
+         && (captured.length > 0) && (captured.at(captured.length - 1) === entry)
+         && ((captureCoalesce === true) || (time - entry.lastTime <= captureCoalesce))) {
+            entry.count++;
+            entry.lastTime = time;
+            return true;
+        }
+        lastCall = {entry: null, key: key};
+        return false;
+    }
+
+    // Counters of the calls by callee and call site:
+    var counters = new Map();
+
+    function count(callee, frame, duration)
+    {
+        var key = callee + '\n' + frame;
+        var counter = counters.get(key);
+        var now = Date.now();
+        if (counter === undefined)
+            counters.set(key, counter = {callee: callee, frame: frame, count: 1, duration: duration, first: now, last: now});
+        else {
+            counter.count++;
+            counter.duration += duration;
+            counter.last = now;
+        }
+        return counter;
+    }
+
+    function getCounters(times)
+    {
+        var table = [];
+        counters.forEach((counter) => {
+            var row = {callee: counter.callee, count: counter.count, duration: counter.duration};
+            parseFrame(row, counter.frame);
+            if (times) {
+                row.first = counter.first;
+                row.last = counter.last;
             }
+            table.push(row);
+        });
+        return table;
+    }
 
-            return cleanValue;
+    // Sequence numbers of the captured calls by callee:
+    var calleeIndex = new Map();
+
+    function lowerBound(length, predicate)
+    {
+        var lo = 0;
+        var hi = length;
+        while (lo < hi) {
+            var mid = (lo + hi) >> 1;
+            if (predicate(mid))
+                hi = mid;
+            else
+                lo = mid + 1;
+        }
+        return lo;
+    }
+
+    function pruneIndex(seqs)
+    {
+        var first = (captured.length > 0) ? captured.at(0).seq : captureSeq;
+        seqs.splice(0, lowerBound(seqs.length, (i) => seqs[i] >= first));
+    }
+
+    function indexCall(cap)
+    {
+        var seqs = calleeIndex.get(cap.callee);
+        if (seqs === undefined)
+            calleeIndex.set(cap.callee, seqs = []);
+        seqs.push(cap.seq);
+        // Forget the calls which were dropped from the capture:
+        if (seqs.length > 2 * captured.length + 16)
+            pruneIndex(seqs);
+    }
+
+    function query(params)
+    {
+        if ((params === undefined) || (params === null))
+            params = {};
+        if (!isA(params, 'Object'))
+            throw new TypeError("Capture query parameters must be an object");
+        ['since', 'until', 'limit'].forEach((name) => {
+            if ((params[name] !== undefined) && (params[name] !== null) && !isA(params[name], 'Number'))
+                throw new TypeError("Capture query " + name + " must be a number");
+        });
+
+        var since = params.since;
+        var until = params.until;
+        var limit = ((params.limit === undefined) || (params.limit === null)) ? Infinity : params.limit;
+        var fileName = null;
+        if ((params.fileName !== undefined) && (params.fileName !== null)) {
+            try {
+                fileName = new RegExp(params.fileName);
+            } catch (e) {
+                throw new RangeError("Capture query fileName is not a valid regular expression: " + params.fileName);
+            }
+        }
+
+        // The times of the calls never decrease:
+        var lo = ((since === undefined) || (since === null)) ? 0 : lowerBound(captured.length, (i) => captured.at(i).time >= since);
+        var hi = ((until === undefined) || (until === null)) ? captured.length : lowerBound(captured.length, (i) => captured.at(i).time > until);
+        if (lo >= hi)
+            return [];
+
+        var positions;
+        if ((params.callee === undefined) || (params.callee === null)) {
+            positions = null;
+        } else {
+            var callees = isA(params.callee, 'String') ? [params.callee] : Array.from(params.callee);
+            var first = captured.at(lo).seq;
+            var last = captured.at(hi - 1).seq;
+            var seqs = [];
+            callees.forEach((callee) => {
+                var calleeSeqs = calleeIndex.get(callee);
+                if (calleeSeqs === undefined)
+                    return;
+                pruneIndex(calleeSeqs);
+                var start = lowerBound(calleeSeqs.length, (i) => calleeSeqs[i] >= first);
+                var end = lowerBound(calleeSeqs.length, (i) => calleeSeqs[i] > last);
+                seqs = seqs.concat(calleeSeqs.slice(start, end));
+            });
+            if (callees.length > 1)
+                seqs.sort((a, b) => a - b);
+            positions = seqs.map((seq) => captured.search(seq));
+        }
+
+        var results = [];
+        var count = (positions === null) ? hi - lo : positions.length;
+        for (var i = 0; (i < count) && (results.length < limit); i++) {
+            var entry = captured.at((positions === null) ? lo + i : positions[i]);
+            if (fileName !== null) {
+                resolve(entry);
+                if ((entry.fileName === undefined) || !fileName.test(entry.fileName))
+                    continue;
+            }
+            results.push(entry);
         }
+        return results;
+    }
+
+    // Getters and setters of the capture settings:
+    var settings = {};
+
+    function status()
+    {
+        var status = {};
+        Object.keys(settings).forEach((name) => {
+            status[name] = settings[name].get();
+        });
+        status.length = captured.length;
+        status.seq = captureSeq;
+        status.bytes = captured.bytes;
+        return status;
+    }
+
+    // Overhead of the capture (the times are in milliseconds):
+    var statsBounds = [0.01, 0.1, 1, 10, 100];
+    var stats = null;
+    var stackTime = 0; // Time spent on the stack of the current call
+
+    function newTimer()
+    {
+        return {count: 0, total: 0, max: 0, histogram: statsBounds.map(() => 0).concat([0])};
+    }
+
+    function resetStats()
+    {
+        stats = {calls: 0, recorded: 0, failed: 0, clean: newTimer(), stack: newTimer()};
+    }
+    resetStats();
+
+    function measure(timer, time)
+    {
+        timer.count++;
+        timer.total += time;
+        timer.max = Math.max(timer.max, time);
+        timer.histogram[lowerBound(statsBounds.length, (i) => time <= statsBounds[i])]++;
+    }
+
+    function getStats()
+    {
+        return Object.assign({
+            bounds: statsBounds,
+            entries: captured.length,
+            bytes: captured.bytes,
+            dropped: captured.dropped,
+        }, JSON.parse(JSON.stringify(stats)));
     }
 
     var obj = window[objName];
     var newObj = {
         capture: {
-            get: () => {
-                return cloneInto(captured, window, {wrapReflectors: true});
+            // The calls captured since the given sequence number, in the given format:
+            //  - `null`: A list of calls,
+            //  - `compact`: `{length, strings, columns}`, where `columns` maps each key
+            //    to the list of its values (`null` when missing) and `callee`, `caller`
+            //    and `fileName` are indexes in `strings`,
+            //  - `lazy`: The same, with `format: 'lazy'` and the arguments of each call
+            //    as a JSON string (where DOM elements are replaced by their type).
+            get: (since, format) => {
+                var from = 0;
+                if ((since !== undefined) && (since !== null)) {
+                    if (!Number.isInteger(since))
+                        throw new TypeError("Capture sequence number must be an integer");
+                    // A cursor ahead of the sequence belongs to a previous document:
+                    if (since <= captureSeq)
+                        from = captured.search(since);
+                }
+                return exportEntries(captured.slice(from), format);
             },
             clear: () => {
-                captured = [];
+                captured.clear();
+                idleQueue = [];
+                calleeIndex.clear();
+                counters.clear();
+            },
+            // The number and total duration of the calls for each callee and call site
+            // (and the times of the first and last ones), counted in `counters` mode:
+            counters: (times) => {
+                return cloneInto(getCounters(times), window);
+            },
+            // Calls the callback with the calls kept by the background script for the
+            // tab (see `persist`), tagged with the URL of their page (`url`):
+            history: (format, clear, callback) => {
+                getHistory(format, clear, callback);
+            },
+            // Calls the callback with the calls of all the frames of the tab, sorted by
+            // time and tagged with the id (`frame`) and the URL (`frameUrl`) of their frame:
+            frames: (format, callback) => {
+                gatherFrames(format, callback);
+            },
+            // The calls matching all the given parameters, selected using the indexes:
+            //  - `callee`: The name(s) of the member(s) which were called,
+            //  - `since` and `until`: The range of times of the calls,
+            //  - `fileName`: A regular expression the caller file name must match,
+            //  - `limit`: The maximum number of calls to return,
+            //  - `format`: The format of the result (see `get()`).
+            query: (params) => {
+                return exportEntries(query(params), params ? params.format : undefined);
+            },
+            // Changes several settings at once and returns the status:
+            configure: (options) => {
+                Object.keys(options).forEach((name) => {
+                    if (!(name in settings))
+                        throw new ReferenceError("Unknown capture setting " + name);
+                    if (settings[name].set === undefined)
+                        throw new TypeError("Capture setting " + name + " is read-only");
+                    settings[name].set(options[name]);
+                });
+                return cloneInto(status(), window);
+            },
+            // All the settings, the number of calls (`length`), their approximate size
+            // (`bytes`) and the next sequence number (`seq`):
+            status: () => {
+                return cloneInto(status(), window);
+            },
+            resetStats: () => {
+                resetStats();
+            },
+            drain: (format) => {
+                var entries = captured.slice(0);
+                captured.clear();
+                idleQueue = [];
+                calleeIndex.clear();
+                return exportEntries(entries, format);
             },
         },
         original: {},
     };
 
-    Object.keys(obj).forEach((key) => {
-        newObj[key] = function() {
-            obj[key](... arguments);
+    function needsStack()
+    {
+        return (captureStack != 'off') || (captureFilters.fileName !== null) || (captureMode == 'counters');
+    }
+
+    function accept(callee, args)
+    {
+        if (captured.stopped) {
+            captured.dropped++;
+            return false;
+        }
+        return acceptCall(callee, args);
+    }
+
+    function record(callee, args, stack, start, duration)
+    {
+        var frame;
+        if (stack !== null) {
+            var begin = stack.indexOf('\n') + 1;
+            var end = stack.indexOf('\n', begin);
+            var sliceStart = performance.now();
+            frame = stack.slice(begin, (end < 0) ? stack.length : end);
+            stackTime += performance.now() - sliceStart;
+            if (!acceptFrame(frame))
+                return null;
+        }
+
+        if (captureMode == 'counters')
+            return count(callee, frame, duration);
+
+        var time = Date.now();
+        var raw = null;
+        if (captureDefer === false) {
+            var cleanStart = performance.now();
+            args = clean(args);
+            measure(stats.clean, performance.now() - cleanStart);
+        } else {
+            // Only the references are kept, the arguments are serialized later:
+            raw = args = Array.prototype.slice.call(args);
+        }
+        if ((captureCoalesce !== false) && coalesce(callee, frame, args, time)) {
+            // The call is forwarded again with its new count (with the same sequence number):
+            if (forwarding() && (pushed[pushed.length - 1] !== lastCall.entry))
+                forward(lastCall.entry);
+            return null;
+        }
 
-            var cap = {
-                callee: key,
-                time: Date.now(),
-                arguments: clean(arguments),
-            };
+        var cap = {
+            seq: captureSeq++,
+            callee: callee,
+            time: time,
+            start: start,
+            duration: duration,
+            arguments: (raw === null) ? args : null,
+        };
+        if (captureCoalesce !== false) {
+            cap.count = 1;
+            cap.lastTime = time;
+        }
 
-            var stack = (new Error()).stack.split('\n');
-            var stackLineFields = (/^([^@]*)@(.*):(\d+):(\d+)$/).exec(stack[1]);
+        if (captureStack == 'full') {
+            var parseStart = performance.now();
+            parseFrame(cap, frame);
+            stackTime += performance.now() - parseStart;
+        } else if (captureStack == 'lazy')
+            lazyFrames.set(cap, frame);
 
-            if (stackLineFields !== null) {
-                cap.caller = stackLineFields[1];
-                cap.fileName = stackLineFields[2];
-                cap.lineNumber = stackLineFields[3];
-                cap.columnNumber = stackLineFields[4];
+        if (captured.push(cap, sizeOf(cap))) {
+            if (raw !== null) {
+                deferred.set(cap, raw);
+                if (captureDefer == 'idle') {
+                    idleQueue.push(cap);
+                    scheduleIdle();
+                }
             }
+            stats.recorded++;
+            indexCall(cap);
+            lastCall.entry = cap;
+        }
+        if (forwarding())
+            forward(cap);
+        return cap;
+    }
+
+    function isThenable(value)
+    {
+        return (value !== null) && ((typeof value == 'object') || (typeof value == 'function')) && (typeof value.then == 'function');
+    }
+
+    // The duration of an asynchronous call (e.g. fetch) lasts until its result settles:
+    function settle(record, result, start, duration)
+    {
+        if ((record === null) || !isThenable(result))
+            return;
+        var settled = exportFunction(() => {
+            record.duration += performance.now() - start - duration;
+        }, window);
+        result.then(settled, settled);
+    }
 
-            captured.push(cap);
+    function wrapCall(callee, call)
+    {
+        return function() {
+            var start = performance.now();
+            var result;
+            try {
+                return result = call(this, arguments, new.target);
+            } finally {
+                var duration = performance.now() - start;
+                stats.calls++;
+                try {
+                    if (accept(callee, arguments)) {
+                        var stack = null;
+                        if (needsStack()) {
+                            // The stack must be taken here, so that its second frame is the caller:
+                            var stackStart = performance.now();
+                            stack = (new Error()).stack;
+                            stackTime = performance.now() - stackStart;
+                        }
+                        settle(record(callee, arguments, stack, start, duration), result, start, duration);
+                        if (stack !== null)
+                            measure(stats.stack, stackTime);
+                    }
+                } catch (e) {
+                    // The caller gets the result of the call, whatever happens to the capture:
+                    stats.failed++;
+                }
+            }
         };
+    }
+
+    // Functions wrapped for each target, to restore them:
+    var wrapped = new Map();
+
+    function isConstructor(f)
+    {
+        // Classes, and functions whose prototype has methods:
+        if (Function.prototype.toString.call(f).startsWith('class'))
+            return true;
+        var prototype = f.prototype;
+        return (prototype !== undefined) && (prototype !== null)
+            && Object.getOwnPropertyNames(prototype).some((key) => key != 'constructor');
+    }
+
+    function resolveTarget(path)
+    {
+        var names = path.split('.');
+        var name = names.pop();
+        var parent = window.wrappedJSObject;
+        for (var n of names) {
+            if ((parent === undefined) || (parent === null))
+                break;
+            parent = parent[n];
+        }
+        if ((parent === undefined) || (parent === null) || !(name in parent))
+            return null;
+
+        var target = parent[name];
+        // The wrappers have no prototype, so the constructors cannot be captured:
+        if ((typeof target == 'function') && isConstructor(target))
+            throw new TypeError("Capture target " + path + " is a constructor");
+        if (typeof target == 'function')
+            return [{parent: parent, name: name, callee: path}];
+        if ((target === null) || (typeof target != 'object'))
+            throw new TypeError("Capture target " + path + " is neither a function nor an object");
+        // Only the own methods (getters would be called on the prototypes):
+        var members = [];
+        Object.getOwnPropertyNames(target).forEach((key) => {
+            var desc = Object.getOwnPropertyDescriptor(target, key);
+            if ((typeof desc.value == 'function') && desc.writable && (key != 'constructor') && !isConstructor(desc.value))
+                members.push({parent: target, name: key, callee: path + '.' + key});
+        });
+        return members;
+    }
+
+    function wrapTarget(path, members)
+    {
+        members.forEach((member) => {
+            var original = member.original = member.parent[member.name];
+            member.parent[member.name] = exportFunction(wrapCall(member.callee, (self, args, newTarget) => {
+                if (newTarget !== undefined)
+                    return Reflect.construct(original, args, newTarget);
+                return original.apply(self, args);
+            }), window);
+        });
+        wrapped.set(path, members);
+    }
+
+    function unwrapTarget(path)
+    {
+        wrapped.get(path).forEach((member) => {
+            member.parent[member.name] = member.original;
+        });
+        wrapped.delete(path);
+    }
+
+    function setTargets(t, strict)
+    {
+        if (!isA(t, 'Array') || !Array.from(t).every((path) => isA(path, 'String')))
+            throw new TypeError("Capture targets must be an array of strings");
+        var targets = Array.from(t);
+        // Resolve all the new targets before changing anything:
+        var members = new Map();
+        targets.forEach((path) => {
+            if (wrapped.has(path) || members.has(path))
+                return;
+            var m = null;
+            try {
+                m = resolveTarget(path);
+            } catch (e) {
+                // The targets of the other documents may not apply to this one:
+                if (strict)
+                    throw e;
+            }
+            if ((m === null) && strict)
+                throw new ReferenceError("Unknown capture target " + path);
+            if (m !== null)
+                members.set(path, m);
+        });
+
+        Array.from(wrapped.keys()).forEach((path) => {
+            if (!targets.includes(path))
+                unwrapTarget(path);
+        });
+        members.forEach((m, path) => wrapTarget(path, m));
+        captureTargets = targets;
+    }
+
+    Object.keys(obj).forEach((key) => {
+        newObj[key] = wrapCall(key, (self, args) => obj[key](... args));
         newObj.original[key] = function() {
             obj[key](... arguments);
         };
@@ -131,17 +1154,149 @@ function capture(objName)
 
     window.wrappedJSObject[objName] = cloneInto(newObj, window, {cloneFunctions: true});
 
-    Object.defineProperty(window.wrappedJSObject[objName].capture, 'depth', {
+    function defineCaptureProperty(name, getter, setter)
+    {
+        settings[name] = {get: getter, set: setter};
+        var desc = {
+            enumerable: true,
+            get: cloneInto(getter, window, {cloneFunctions: true}),
+        };
+        if (setter !== undefined)
+            desc.set = cloneInto(setter, window, {cloneFunctions: true});
+        Object.defineProperty(window.wrappedJSObject[objName].capture, name, desc);
+    }
+
+    // The overhead of the capture since the last call to `resetStats()`: the
+    // number of wrapped calls (`calls`), of stored calls (`recorded`) and of calls whose
+    // capture failed (`failed`, e.g. because of a throwing getter), the number
+    // (`entries`), approximate size (`bytes`) and number of dropped calls (`dropped`)
+    // and the times spent serializing the arguments (`clean`) and capturing the call
+    // sites (`stack`), with their `count`, `total`, `max` and `histogram`, whose
+    // buckets are bounded by `bounds`. Not a setting, so that the status stays cheap:
+    Object.defineProperty(window.wrappedJSObject[objName].capture, 'stats', {
         enumerable: true,
-        get: cloneInto(() => captureDepth, window, {cloneFunctions: true}),
-        set: cloneInto((d) => {
-            if (!Number.isInteger(d))
-                throw new TypeError("Capure depth must be an integer");
-            if (d < 0)
-                throw new RangeError("Capure depth must be non-negative");
-            captureDepth = d;
-        }, window, {cloneFunctions: true}),
+        get: cloneInto(() => cloneInto(getStats(), window), window, {cloneFunctions: true}),
+    });
+
+    // Identifies the document, so that users can detect navigations:
+    defineCaptureProperty('document', () => captureDocument);
+    // The size of the serialized arguments (`0` means no limit): depth of the objects,
+    // length of the strings, items of the arrays, keys of the objects and
+    // approximate size of the arguments of a call:
+    defineCaptureProperty('depth', () => captureDepth, (d) => {
+        if (!Number.isInteger(d))
+            throw new TypeError("Capure depth must be an integer");
+        if (d < 0)
+            throw new RangeError("Capure depth must be non-negative");
+        captureDepth = d;
+    });
+    Object.keys(captureLimits).forEach((name) => {
+        defineCaptureProperty(name, () => captureLimits[name], (l) => {
+            if (!Number.isInteger(l))
+                throw new TypeError("Capture limit " + name + " must be an integer");
+            if (l < 0)
+                throw new RangeError("Capture limit " + name + " must be non-negative");
+            captureLimits[name] = l;
+        });
+    });
+    // Whether the calls are stored (`entries`) or only counted (`counters`):
+    defineCaptureProperty('mode', () => captureMode, (m) => {
+        if (!isA(m, 'String'))
+            throw new TypeError("Capture mode must be a string");
+        if (!['entries', 'counters'].includes(m))
+            throw new RangeError("Capture mode must be one of 'entries' or 'counters'");
+        captureMode = m;
+    });
+    // Whether identical consecutive calls (same callee, call site and arguments) are
+    // stored once, with their number (`count`) and the time of the last one
+    // (`lastTime`). When it is a number, the calls must also be at most this
+    // number of milliseconds apart. The updated calls are pushed again:
+    defineCaptureProperty('coalesce', () => captureCoalesce, (c) => {
+        if (!isA(c, 'Boolean') && !Number.isInteger(c))
+            throw new TypeError("Capture coalescing must be a boolean or an integer");
+        if (c < 0)
+            throw new RangeError("Capture coalescing window must be non-negative");
+        captureCoalesce = (c === 0) ? false : c;
+    });
+    // When the arguments are serialized: during the call (`false`), when the page
+    // is idle (`idle`) or when the capture is read (`get`). Deferred arguments are
+    // captured in their later state, their size is only accounted once they are
+    // serialized and coalescing compares them by identity:
+    defineCaptureProperty('defer', () => captureDefer, (d) => {
+        if ((d !== false) && !isA(d, 'String'))
+            throw new TypeError("Capture deferral must be false or a string");
+        if (![false, 'idle', 'get'].includes(d))
+            throw new RangeError("Capture deferral must be one of false, 'idle' or 'get'");
+        captureDefer = d;
+    });
+    // When the call site is captured: not at all (`off`), parsed when the capture
+    // is read (`lazy`) or parsed immediately (`full`):
+    defineCaptureProperty('stack', () => captureStack, (m) => {
+        if (!isA(m, 'String'))
+            throw new TypeError("Capture stack mode must be a string");
+        if (!['off', 'lazy', 'full'].includes(m))
+            throw new RangeError("Capture stack mode must be one of 'off', 'lazy' or 'full'");
+        captureStack = m;
+    });
+    // The bounds and overflow policy of the CaptureBuffer:
+    defineCaptureProperty('capacity', () => captured.capacity, (c) => {
+        if (!Number.isInteger(c))
+            throw new TypeError("Capture capacity must be an integer");
+        if (c < 0)
+            throw new RangeError("Capture capacity must be non-negative");
+        captured.resize(c, captured.maxBytes);
+    });
+    defineCaptureProperty('maxBytes', () => captured.maxBytes, (b) => {
+        if (!Number.isInteger(b))
+            throw new TypeError("Capture maximum size must be an integer");
+        if (b < 0)
+            throw new RangeError("Capture maximum size must be non-negative");
+        captured.resize(captured.capacity, b);
+    });
+    defineCaptureProperty('overflow', () => captured.overflow, (o) => {
+        if (!isA(o, 'String'))
+            throw new TypeError("Capture overflow policy must be a string");
+        if (!['oldest', 'newest', 'stop'].includes(o))
+            throw new RangeError("Capture overflow policy must be one of 'oldest', 'newest' or 'stop'");
+        captured.overflow = o;
+    });
+    defineCaptureProperty('dropped', () => captured.dropped);
+    // Restricts the calls before they are serialized:
+    //  - `allow`: The names of the only members whose calls are captured,
+    //  - `deny`: The names of the members whose calls are not captured,
+    //  - `fileName`: A regular expression the caller file name must match,
+    //  - `prefix`: A string the first argument must start with.
+    defineCaptureProperty('filters', () => cloneInto(captureFilters.spec, window), setFilters);
+    // The URL to which the background script pushes the calls in batches:
+    defineCaptureProperty('push', () => capturePush, (u) => {
+        if ((u !== null) && !isA(u, 'String'))
+            throw new TypeError("Capture push URL must be a string or null");
+        capturePush = u;
+        browser.runtime.sendMessage({type: 'configure', config: {push: u}});
+    });
+    // The number of calls kept by the background script for each tab,
+    // so that they survive navigations (see `history()`):
+    defineCaptureProperty('persist', () => capturePersist, (n) => {
+        if (!Number.isInteger(n))
+            throw new TypeError("Capture persistence must be an integer");
+        if (n < 0)
+            throw new RangeError("Capture persistence must be non-negative");
+        capturePersist = n;
+        browser.runtime.sendMessage({type: 'configure', config: {persist: n}});
+    });
+    // Other functions of the page to capture, as paths from `window` (like `fetch`
+    // or `app.api.load`), whose callee is their path. When a path leads to an
+    // object, its own methods are captured (`Storage.prototype` captures the calls
+    // to `localStorage` and `sessionStorage`). Constructors (classes and functions
+    // whose prototype has methods) cannot be captured. The targets are shared by
+    // all the documents through the background script:
+    defineCaptureProperty('targets', () => cloneInto(captureTargets, window), (t) => {
+        setTargets(t, true);
+        browser.runtime.sendMessage({type: 'configure', config: {targets: captureTargets}});
     });
 }
 
 capture('console');
+
+// Notify the page (and Selenium) that the capture is ready:
+window.dispatchEvent(new CustomEvent('consolecaptureready'));
@@ -15,62 +15,1168 @@
 # You should have received a copy of the GNU General Public License
 # along with ConsoleCapture. If not, see <http://www.gnu.org/licenses/>
 
-import time
+import asyncio
+import collections.abc
+import concurrent.futures
+import gzip
+import http.server
+import inspect
+import io
+import json
+import os
+import queue
+import threading
+import weakref
 
 from warnings import warn
 from selenium.common import exceptions as selenium
+from selenium.webdriver.remote.webelement import WebElement
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+def _isReference(value):
+    return isinstance(value, dict) and (len(value) == 1) and ('$ref' in value)
+
+def _resolveReferences(value, root):
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return value
+
+    for key, item in list(items):
+        if _isReference(item):
+            target = root
+            for k in item['$ref']:
+                target = target[k]
+            value[key] = target
+        else:
+            _resolveReferences(item, root)
+    return value
+
+def _unescapeKeys(value, seen):
+    # Shared objects must be unescaped once:
+    if id(value) in seen:
+        return
+    if isinstance(value, dict):
+        seen.add(id(value))
+        items = list(value.items())
+        if any(k.startswith('$$') for k, v in items):
+            value.clear()
+            value.update((k[1:] if k.startswith('$$') else k, v) for k, v in items)
+        values = value.values()
+    elif isinstance(value, list):
+        seen.add(id(value))
+        values = value
+    else:
+        return
+    for item in values:
+        _unescapeKeys(item, seen)
+
+def _decodeArguments(args):
+    # References use the escaped keys, so they are resolved first:
+    args = _resolveReferences(args, args)
+    _unescapeKeys(args, set())
+    return args
+
+def _decodeColumns(capture):
+    strings = capture['strings']
+    entries = [{} for i in range(capture['length'])]
+    for key, column in capture['columns'].items():
+        for entry, value in zip(entries, column):
+            if value is None:
+                continue
+            if key in ('callee', 'caller', 'fileName'):
+                value = strings[value]
+            elif key in ('lineNumber', 'columnNumber'):
+                value = str(value)
+            entry[key] = value
+    return entries
+
+class ConsoleCaptureEntry(collections.abc.Mapping):
+    """
+        A call in a ``ConsoleCaptureEntries``
+
+        It can be used as the dictionnary describing the call (with the same
+        keys: ``callee``, ``time``, ``arguments``, ``caller``, ...), but its
+        values are read from the columns of the capture, so that it only holds
+        a reference to the capture and its index. The arguments are decoded
+        when they are first accessed.
+    """
+    __slots__ = ('__entries', '__index')
+
+    def __init__(self, entries, index):
+        self.__entries = entries
+        self.__index = index
+
+    def __getitem__(self, key):
+        return self.__entries.value(key, self.__index)
+
+    def __iter__(self):
+        return (key for key in self.__entries.keys() if self.__entries.has(key, self.__index))
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class ConsoleCaptureEntries(collections.abc.Sequence):
+    """
+        Captured calls kept in columns
+
+        Returned instead of a list of dictionnaries when the capture is
+        retrieved with ``lazy=True``. The values of the calls are kept in one
+        list for each key, as transferred from the browser (repeated strings
+        are stored once) and the arguments of each call are kept as a JSON
+        string until they are accessed. The calls (``ConsoleCaptureEntry``)
+        are only created when they are accessed.
+
+        *Note*: DOM elements in the arguments are replaced by their type, as in
+        ``'[object HTMLBodyElement]'``.
+
+        *Parameters*:
+            - **capture**: The capture in the ``lazy`` format.
+    """
+
+    def __init__(self, capture):
+        self.__length = capture['length']
+        self.__strings = capture['strings']
+        self.__columns = capture['columns']
+        self.__arguments = {}
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ConsoleCaptureEntry(self, i) for i in range(*index.indices(self.__length))]
+        if index < 0:
+            index += self.__length
+        if not (0 <= index < self.__length):
+            raise IndexError("Capture index out of range")
+        return ConsoleCaptureEntry(self, index)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def keys(self):
+        """
+            Get the keys of the calls
+
+            *Returns*: The keys present in at least one call.
+        """
+        return self.__columns.keys()
+
+    def has(self, key, index):
+        """
+            Check whether a call has a key
+
+            *Parameters*:
+                - **key**: The key.
+                - **index**: The index of the call.
+
+            *Returns*: ``True`` if the call has the key.
+        """
+        return (key in self.__columns) and (self.__columns[key][index] is not None)
+
+    def value(self, key, index):
+        """
+            Get the value of a key for a call
+
+            *Parameters*:
+                - **key**: The key.
+                - **index**: The index of the call.
+
+            *Returns*: The decoded value.
+
+            *Raises*: ``KeyError`` if the call does not have the key.
+        """
+        if not self.has(key, index):
+            raise KeyError(key)
+        value = self.__columns[key][index]
+        if key == 'arguments':
+            if index not in self.__arguments:
+                args = json.loads(value)
+                self.__arguments[index] = _decodeArguments(args)
+            return self.__arguments[index]
+        if key in ('callee', 'caller', 'fileName'):
+            return self.__strings[value]
+        if key in ('lineNumber', 'columnNumber'):
+            return str(value)
+        return value
+
+    def column(self, key):
+        """
+            Get the values of a key for all the calls
+
+            *Parameters*:
+                - **key**: The key.
+
+            *Returns*: The list of the decoded values (``None`` for the calls without the key).
+        """
+        return [self.value(key, i) if self.has(key, i) else None for i in range(self.__length)]
+
+    def columns(self, keys=None):
+        """
+            Get the capture in columnar form
+
+            *Parameters*:
+                - **keys**: The keys to get (all the keys if ``None``).
+                  Excluding ``arguments`` avoids decoding them.
+
+            *Returns*: A dictionnary mapping each key to the list of its values.
+        """
+        return {key: self.column(key) for key in (self.keys() if keys is None else keys)}
+
+    def toDataFrame(self, keys=None):
+        """
+            Get the capture as a pandas ``DataFrame``
+
+            *Parameters*:
+                - **keys**: The keys to get (all the keys if ``None``).
+
+            *Returns*: A ``DataFrame`` with one row per call and one column per key.
+        """
+        if pandas is None:
+            raise ImportError("DataFrame conversion requires pandas package")
+        return pandas.DataFrame(self.columns(keys))
+
+def _format(compact, lazy):
+    if lazy:
+        return 'lazy'
+    return 'compact' if compact else None
+
+def _decodeCapture(capture):
+    if isinstance(capture, dict) and (capture.get('format') == 'lazy'):
+        return ConsoleCaptureEntries(capture)
+    if isinstance(capture, dict):
+        capture = _decodeColumns(capture)
+    for entry in capture:
+        if 'arguments' in entry:
+            entry['arguments'] = _decodeArguments(entry['arguments'])
+    return capture
+
+def _javascriptError(e):
+    jsError, sep, msg = e.msg.partition(': ')
+    if (jsError == 'TypeError'):
+        return TypeError(msg)
+    elif (jsError == 'RangeError'):
+        return ValueError(msg)
+    elif (jsError == 'ReferenceError'):
+        return NameError(msg)
+    else:
+        return e
 
 class JavascriptPropertyDescriptor:
-    def __init__(self, propertyName):
+    def __init__(self, propertyName, readOnly=False, toJavascript=str):
         self.__propertyName = propertyName
+        self.__readOnly = readOnly
+        self.__toJavascript = toJavascript
 
     def __get__(self, obj, owner=None):
         return obj.execute_script(f"return {self.__propertyName};")
 
     def __set__(self, obj, value=None):
+        if self.__readOnly:
+            raise AttributeError(f"{self.__propertyName} is read-only")
         try:
-            obj.execute_script(f"{self.__propertyName} = {value};")
+            obj.execute_script(f"{self.__propertyName} = {self.__toJavascript(value)};")
         except selenium.JavascriptException as e:
-            jsError, sep, msg = e.msg.partition(': ')
-            if (jsError == 'TypeError'):
-                raise TypeError(msg)
-            elif (jsError == 'RangeError'):
-                raise ValueError(msg)
-            elif (jsError == 'ReferenceError'):
-                raise NameError(msg)
-            else:
-                raise
+            raise _javascriptError(e)
 
-class ConsoleCaptureDescriptor:
-    class __ConsoleCaptureDescriptor:
-        depth = JavascriptPropertyDescriptor('console.capture.depth')
+class ConsoleCaptureAccessor:
+    """
+        Capture of a WebDriver (``browser.consoleCapture``)
+
+        Each captured call is a dictionnary with the console function
+        (``callee``), the time of the call, its start time in ``start``
+        (given by ``performance.now()`` in the page), its duration in
+        ``duration`` (in milliseconds, until its result settles when it is
+        a promise), its ``arguments`` and its call site
+        (``caller``, ``fileName``, ``lineNumber`` and ``columnNumber``).
+        Objects referenced several times in the arguments of a call
+        (including cyclic references) are transferred once and the
+        references are restored in the returned arguments.
+
+        When **ConsoleCapture** is not ready in the current page (e.g. after
+        a navigation), the methods wait for it at most ``timeout`` seconds
+        (which can be changed at any time). Otherwise, each access costs a
+        single WebDriver round trip.
+
+        *Note*: It is created by ``captureConsole()``, not directly.
+
+        The capture is controlled by the following properties:
 
-        def execute_script(self, script, *args):
-            return self.__obj.execute_script(script, *args)
+            - ``depth``, ``maxString``, ``maxArray``, ``maxKeys`` and
+              ``maxEntryBytes``: The maximum depth of the arguments, length
+              of the strings, number of items of the arrays, number of keys
+              of the objects and approximate size of the arguments of a call
+              (``0`` means no limit). A truncated string is replaced by
+              ``{'$truncated': 'String', 'size': length, 'value': prefix}``,
+              a truncated array ends with ``{'$truncated': 'Array', 'size': length}``
+              and a truncated object has a ``'$truncated'`` key with its
+              original number of keys.
+            - ``stack``: The capture of the call sites: ``'off'`` (not
+              captured), ``'lazy'`` (parsed when the capture is retrieved)
+              or ``'full'`` (parsed immediately, default).
+            - ``defer``: When the arguments are serialized: ``'idle'`` (in
+              batches when the page is idle), ``'get'`` (when the capture is
+              retrieved) or ``False`` (during the calls, default). When
+              deferred, the values modified after the call are captured in
+              their later state, the size of the calls is only accounted (in
+              ``maxBytes``) once they are serialized and coalescing only merges
+              calls with the same arguments (by identity).
+            - ``mode``: ``'entries'`` (default) or ``'counters'`` (the calls
+              are only counted by console function and call site, see
+              ``counters()``).
+            - ``coalesce``: When ``True``, identical consecutive calls (same
+              console function, call site and arguments) are returned once,
+              with their number in ``count`` and the time of the last one in
+              ``lastTime``. When it is an integer, the calls must also be at
+              most this number of milliseconds apart (``0`` or ``False``
+              disables coalescing). Note that a call already returned by
+              ``tail()`` is not returned again when its count increases
+              (but it is pushed again, see ``push``).
+            - ``filters``: A dictionnary selecting the calls before they are
+              serialized (``None`` disables filtering), with the optional
+              keys ``allow`` (the only console functions to capture), ``deny``
+              (the console functions not to capture), ``fileName`` (a
+              JavaScript regular expression the caller file name must match)
+              and ``prefix`` (a string the first argument must start with).
+            - ``capacity`` and ``maxBytes``: The maximum number of calls and
+              approximate size of the capture (``0`` means no limit).
+            - ``overflow``: The calls dropped when the capture is full:
+              ``'oldest'`` (default), ``'newest'`` or ``'stop'`` (the capture
+              stops until it is cleared). ``dropped`` is the number of
+              dropped calls.
+            - ``targets``: The paths from ``window`` of other functions to
+              capture (e.g. ``['fetch', 'app.api.load']``), whose callee is
+              their path. When a path leads to an object, its own methods
+              are captured, so the methods of classes must be given through
+              their prototype (e.g. ``'Storage.prototype'``). Constructors
+              cannot be captured. The targets are also applied to the pages
+              loaded afterwards, when they exist in them (a ``NameError`` is
+              raised if a target does not exist in the current page).
+            - ``persist``: The number of calls kept by the extension for each
+              tab across navigations (see ``history()``).
+            - ``push``: The URL of a ``ConsoleCaptureCollector`` to which the
+              calls are pushed (``None`` stops pushing).
+    """
 
-        def __init__(self, obj):
-            self.__obj = obj
+    depth = JavascriptPropertyDescriptor('console.capture.depth')
+    maxString = JavascriptPropertyDescriptor('console.capture.maxString')
+    maxArray = JavascriptPropertyDescriptor('console.capture.maxArray')
+    maxKeys = JavascriptPropertyDescriptor('console.capture.maxKeys')
+    maxEntryBytes = JavascriptPropertyDescriptor('console.capture.maxEntryBytes')
+    mode = JavascriptPropertyDescriptor('console.capture.mode', toJavascript=json.dumps)
+    coalesce = JavascriptPropertyDescriptor('console.capture.coalesce', toJavascript=json.dumps)
+    defer = JavascriptPropertyDescriptor('console.capture.defer', toJavascript=json.dumps)
+    stack = JavascriptPropertyDescriptor('console.capture.stack', toJavascript=json.dumps)
+    capacity = JavascriptPropertyDescriptor('console.capture.capacity')
+    maxBytes = JavascriptPropertyDescriptor('console.capture.maxBytes')
+    overflow = JavascriptPropertyDescriptor('console.capture.overflow', toJavascript=json.dumps)
+    dropped = JavascriptPropertyDescriptor('console.capture.dropped', readOnly=True)
+    filters = JavascriptPropertyDescriptor('console.capture.filters', toJavascript=json.dumps)
+    push = JavascriptPropertyDescriptor('console.capture.push', toJavascript=json.dumps)
+    persist = JavascriptPropertyDescriptor('console.capture.persist')
+    targets = JavascriptPropertyDescriptor('console.capture.targets', toJavascript=json.dumps)
 
-        def __call__(self):
-            return self.__obj.execute_script("return console.capture.get();")
+    def __init__(self, obj, timeout):
+        self.__obj = obj
+        self.__document = None
+        self.__cursor = (None, 0)
+        self.timeout = timeout
 
-    @staticmethod
-    def __waitConsoleCapture(browser, t=-1):
-        while (t != 0) and browser.execute_script("return (console.capture === undefined);"):
-            time.sleep(1)
-            t = t - 1
-        if (t == 0):
+    def __waitConsoleCapture(self):
+        ready = self.__obj.execute_async_script("""
+            var done = arguments[arguments.length - 1];
+            if (console.capture !== undefined)
+                return done(true);
+            var timer = setTimeout(() => done(false), arguments[0]);
+            window.addEventListener('consolecaptureready', () => {
+                clearTimeout(timer);
+                done(true);
+            }, {once: true});
+        """, int(self.timeout * 1000))
+        if not ready:
             raise RuntimeError("Timeout waiting for ConsoleCapture.")
 
+    def __execute(self, execute, script, *args):
+        result = execute(script, *args)
+        if result is None:
+            self.__waitConsoleCapture()
+            result = execute(script, *args)
+            if result is None:
+                raise RuntimeError("ConsoleCapture is not available.")
+        self.__document, value = result
+        return value
+
+    def execute_script(self, script, *args):
+        """
+            Execute a script once **ConsoleCapture** is ready
+
+            The script is run in the same round trip as the readiness check,
+            so that the capture is only waited for after a navigation.
+
+            *Parameters*:
+                - **script**: The script to execute.
+                - **args**: The arguments of the script.
+
+            *Returns*: The value returned by the script.
+        """
+        guardedScript = "if (console.capture === undefined) return null;\n" \
+                      + "return [console.capture.document, (function() {\n" + script + "\n}).apply(null, arguments)];"
+        return self.__execute(self.__obj.execute_script, guardedScript, *args)
+
+    def execute_async_script(self, script, *args):
+        """
+            Execute an asynchronous script once **ConsoleCapture** is ready
+
+            As with Selenium, the script gets a callback as last argument,
+            which it must call with its result.
+
+            *Parameters*:
+                - **script**: The script to execute.
+                - **args**: The arguments of the script.
+
+            *Returns*: The value passed to the callback by the script.
+        """
+        guardedScript = "var done = arguments[arguments.length - 1];\n" \
+                      + "if (console.capture === undefined) return done(null);\n" \
+                      + "var args = Array.prototype.slice.call(arguments, 0, -1);\n" \
+                      + "args.push((value) => done([console.capture.document, value]));\n" \
+                      + "(function() {\n" + script + "\n}).apply(null, args);"
+        return self.__execute(self.__obj.execute_async_script, guardedScript, *args)
+
+    def __advance(self, capture):
+        document, since = self.__cursor
+        # Calls are numbered from 0 in each new document:
+        if (document != self.__document):
+            since = 0
+        if (len(capture) > 0):
+            since = capture[-1]['seq'] + 1
+        self.__cursor = (self.__document, since)
+
+    def __call__(self, compact=False, lazy=False):
+        """
+            Get the capture
+
+            The calls are captured in all the frames of the page, but only
+            the calls of the current frame are returned (see ``frames()``).
+
+            *Parameters*:
+                - **compact**: Whether to transfer the capture in a compact
+                  columnar format, which is smaller for large captures
+                  (the returned calls are the same).
+                - **lazy**: Whether to return a ``ConsoleCaptureEntries`` (decoding the arguments only when accessed).
+
+            *Returns*: The list of the captured calls.
+        """
+        return _decodeCapture(self.execute_script("return console.capture.get(undefined, arguments[0]);", _format(compact, lazy)))
+
+    def tail(self, compact=False, lazy=False):
+        """
+            Get the calls captured since the last call to this method
+
+            Only the calls which were not returned by a previous call to
+            this method are transferred from the browser. The first call
+            returns the whole capture.
+
+            *Parameters*:
+                - **compact**: Whether to use the compact transfer format.
+                - **lazy**: Whether to return a ``ConsoleCaptureEntries`` (decoding the arguments only when accessed).
+
+            *Returns*: The list of the newly captured calls.
+        """
+        document, since = self.__cursor
+        capture = _decodeCapture(self.execute_script("return console.capture.get((console.capture.document == arguments[1]) ? arguments[0] : 0, arguments[2]);", since, document, _format(compact, lazy)))
+        self.__advance(capture)
+        return capture
+
+    def drain(self, compact=False, lazy=False):
+        """
+            Get the capture and clear it
+
+            The capture is returned and cleared atomically in the browser,
+            so that no call can be lost between retrieval and clearing.
+
+            *Parameters*:
+                - **compact**: Whether to use the compact transfer format.
+                - **lazy**: Whether to return a ``ConsoleCaptureEntries`` (decoding the arguments only when accessed).
+
+            *Returns*: The list of the captured calls.
+        """
+        capture = _decodeCapture(self.execute_script("return console.capture.drain(arguments[0]);", _format(compact, lazy)))
+        self.__advance(capture)
+        return capture
+
+    def frames(self, compact=False):
+        """
+            Get the capture of all the frames of the current page
+
+            The captures of all the frames (including the embedded ones)
+            are gathered by the extension in a single round trip.
+
+            *Parameters*:
+                - **compact**: Whether to use the compact transfer format.
+
+            *Returns*: The list of the calls captured in all the frames,
+            sorted by time, with the id (``frame``) and the URL
+            (``frameUrl``) of the frame in which they were captured.
+            DOM elements are replaced by their type, as in
+            ``'[object HTMLBodyElement]'``.
+        """
+        return _decodeCapture(self.execute_async_script("console.capture.frames(arguments[0], arguments[1]);", 'compact' if compact else None))
+
+    def history(self, clear=False, compact=False):
+        """
+            Get the calls captured in the current tab across navigations
+
+            The calls are only kept when ``persist`` is positive.
+
+            *Parameters*:
+                - **clear**: Whether to clear the history of the tab.
+                - **compact**: Whether to use the compact transfer format.
+
+            *Returns*: The list of the calls captured in the current tab,
+            with the URL of the page (``url``) in which they were
+            captured. DOM elements are replaced by their type, as in
+            ``'[object HTMLBodyElement]'``.
+        """
+        return _decodeCapture(self.execute_async_script("console.capture.history(arguments[0], arguments[1], arguments[2]);", 'compact' if compact else None, clear))
+
+    def counters(self, times=False):
+        """
+            Get the call counters
+
+            The calls are only counted when ``mode`` is ``'counters'``, by
+            console function and call site. The counters are reset when the
+            capture is cleared.
+
+            *Parameters*:
+                - **times**: Whether to get the times of the first and last calls.
+
+            *Returns*: The list of the counters, with the keys ``callee``,
+            ``caller``, ``fileName``, ``lineNumber``, ``columnNumber``,
+            ``count``, ``duration`` (the total duration of the calls, in milliseconds)
+            (and ``first`` and ``last`` if ``times`` is true).
+        """
+        return self.execute_script("return console.capture.counters(arguments[0]);", times)
+
+    def query(self, callee=None, since=None, until=None, fileName=None, limit=None, compact=False, lazy=False):
+        """
+            Get the captured calls matching the given criteria
+
+            The calls are selected in the browser, using indexes kept as
+            the calls are captured, so that only the matching calls are
+            transferred.
+
+            *Parameters*:
+                - **callee**: The name (or a list of names) of the console functions.
+                - **since**: The minimum time of the calls (in milliseconds since the epoch).
+                - **until**: The maximum time of the calls (in milliseconds since the epoch).
+                - **fileName**: A (JavaScript) regular expression the caller file name must match.
+                - **limit**: The maximum number of calls to return.
+                - **compact**: Whether to use the compact transfer format.
+                - **lazy**: Whether to return a ``ConsoleCaptureEntries`` (decoding the arguments only when accessed).
+
+            *Returns*: The list of the matching captured calls.
+        """
+        params = {'callee': callee, 'since': since, 'until': until, 'fileName': fileName, 'limit': limit}
+        params = {k: v for k, v in params.items() if v is not None}
+        if compact or lazy:
+            params['format'] = _format(compact, lazy)
+        try:
+            return _decodeCapture(self.execute_script("return console.capture.query(arguments[0]);", params))
+        except selenium.JavascriptException as e:
+            raise _javascriptError(e)
+
+    def clear(self):
+        """
+            Clear the capture
+        """
+        self.execute_script("console.capture.clear();")
+
+    def configure(self, **options):
+        """
+            Change several capture settings at once
+
+            The settings are changed in a single round trip, in the given
+            order (a setting after an invalid one is not changed).
+
+            *Parameters*:
+                - **options**: The new values of the settings
+                  (e.g. ``depth=1, capacity=1000``).
+
+            *Returns*: The capture status (see ``status()``).
+        """
+        try:
+            return self.execute_script("return console.capture.configure(arguments[0]);", options)
+        except selenium.JavascriptException as e:
+            raise _javascriptError(e)
+
+    def status(self):
+        """
+            Get the capture status
+
+            *Returns*: A dictionnary with all the capture settings
+            (``depth``, ``capacity``, ...) and counters: ``length`` (the
+            number of captured calls), ``bytes`` (their approximate size),
+            ``dropped`` (the number of dropped calls) and ``seq`` (the
+            sequence number of the next call).
+        """
+        return self.execute_script("return console.capture.status();")
+
+    def stats(self, reset=False):
+        """
+            Get the overhead of the capture
+
+            The times are in milliseconds, with the precision of
+            ``performance.now()`` in the page.
+
+            *Parameters*:
+                - **reset**: Whether to reset the counts and times after getting them.
+
+            *Returns*: A dictionnary with the keys ``calls`` (the number of
+            calls to the captured functions), ``recorded`` (the number of
+            stored calls), ``failed`` (the number of calls which could not
+            be captured, e.g. because of a throwing getter), ``entries`` (the number of calls currently
+            stored), ``bytes`` (their approximate size), ``dropped``,
+            ``clean`` (the time spent serializing the arguments) and
+            ``stack`` (the time spent capturing the call sites). The times
+            are dictionnaries with ``count``, ``total``, ``max`` and
+            ``histogram``, whose buckets are bounded by ``bounds``
+            (the last bucket has no upper bound).
+        """
+        return self.execute_script("var stats = console.capture.stats;\n" \
+                                 + "if (arguments[0])\n" \
+                                 + "    console.capture.resetStats();\n" \
+                                 + "return stats;", reset)
+
+class ConsoleCaptureDescriptor:
+    def __init__(self, timeout=5):
+        self.__timeout = timeout
+        self.__captures = weakref.WeakKeyDictionary()
+
+    def __capture(self, obj):
+        try:
+            return self.__captures[obj]
+        except KeyError:
+            capture = self.__captures[obj] = ConsoleCaptureAccessor(obj, self.__timeout)
+            return capture
+
     def __get__(self, obj, owner=None):
-        self.__waitConsoleCapture(obj, 5)
-        return self.__ConsoleCaptureDescriptor(obj)
+        if obj is None:
+            return self
+        return self.__capture(obj)
 
     def __delete__(self, obj):
-        self.__waitConsoleCapture(obj, 5)
-        return obj.execute_script("return console.capture.clear();")
+        self.__capture(obj).clear()
+
+class AsyncConsoleCaptureAccessor:
+    """
+        Capture of a WebDriver for ``asyncio`` (``browser.asyncConsoleCapture``)
+
+        ``await browser.asyncConsoleCapture()`` and the methods work as those
+        of ``ConsoleCaptureAccessor``, but the WebDriver calls are run in
+        ``executor`` (the default executor if ``None``), one at a time.
 
-def captureConsole(browser, xpiPath):
+        *Note*: It is created by ``captureConsole()``, not directly.
+    """
+
+    def __init__(self, capture):
+        self.__capture = capture
+        self.__lock = threading.Lock()
+        self.executor = None
+
+    def __locked(self, function, *args):
+        # The capture state (e.g. tail cursor) is not shared between threads:
+        with self.__lock:
+            return function(*args)
+
+    async def __run(self, function, *args):
+        # The lock is not bound to an event loop, since the descriptor outlives them:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.__locked, function, *args)
+
+    async def __call__(self, compact=False, lazy=False):
+        return await self.__run(self.__capture, compact, lazy)
+
+    async def tail(self, compact=False, lazy=False):
+        """
+            Get the calls captured since the last call to ``tail()``
+
+            *Parameters*:
+                - **compact**: Whether to use the compact transfer format.
+                - **lazy**: Whether to return a ``ConsoleCaptureEntries`` (decoding the arguments only when accessed).
+
+            *Returns*: The list of the newly captured calls.
+        """
+        return await self.__run(self.__capture.tail, compact, lazy)
+
+    async def drain(self, compact=False, lazy=False):
+        """
+            Get the capture and clear it
+
+            *Parameters*:
+                - **compact**: Whether to use the compact transfer format.
+                - **lazy**: Whether to return a ``ConsoleCaptureEntries`` (decoding the arguments only when accessed).
+
+            *Returns*: The list of the captured calls.
+        """
+        return await self.__run(self.__capture.drain, compact, lazy)
+
+    async def clear(self):
+        """
+            Clear the capture
+        """
+        await self.__run(self.__capture.clear)
+
+    async def getDepth(self):
+        """
+            Get the capture depth
+
+            *Returns*: The capture depth.
+        """
+        return await self.__run(getattr, self.__capture, 'depth')
+
+    async def setDepth(self, depth):
+        """
+            Set the capture depth
+
+            *Parameters*:
+                - **depth**: The new capture depth.
+        """
+        await self.__run(setattr, self.__capture, 'depth', depth)
+
+    async def stream(self, interval=0.05, maxInterval=1):
+        """
+            Iterate asynchronously over the captured calls
+
+            The new calls are polled using ``tail()``. When there is no new
+            call, the polling interval doubles up to ``maxInterval``. It is
+            reset to ``interval`` as soon as new calls are captured.
+
+            *Parameters*:
+                - **interval**: The minimum polling interval (in seconds).
+                - **maxInterval**: The maximum polling interval (in seconds).
+        """
+        delay = interval
+        while True:
+            capture = await self.tail()
+            for entry in capture:
+                yield entry
+            delay = interval if (len(capture) > 0) else min(2 * delay, maxInterval)
+            await asyncio.sleep(delay)
+
+class AsyncConsoleCaptureDescriptor:
+    def __init__(self):
+        self.__captures = weakref.WeakKeyDictionary()
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return self.__captures[obj]
+        except KeyError:
+            capture = self.__captures[obj] = AsyncConsoleCaptureAccessor(obj.consoleCapture)
+            return capture
+
+class ConsoleCapturePool:
+    """
+        Pool of WebDrivers whose captures are handled together
+
+        The operations are run concurrently on all the WebDrivers of the pool,
+        using a pool of threads. They return a pair of dictionnaries, keyed by
+        WebDriver session id: the results for the WebDrivers on which the
+        operation succeeded and the exceptions raised for the others::
+
+            with ConsoleCapturePool(browsers) as pool:
+                pool.install(xpiPath)
+                ...
+                captures, errors = pool.drain()
+
+        *Parameters*:
+            - **browsers**: The Selenium WebDrivers in the pool.
+            - **workers**: The maximum number of concurrent operations.
+    """
+
+    def __init__(self, browsers, workers=8):
+        self.__browsers = list(browsers)
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    @property
+    def browsers(self):
+        """
+            The WebDrivers in the pool
+        """
+        return list(self.__browsers)
+
+    def map(self, function, *args, **kwargs):
+        """
+            Run a function concurrently on all the WebDrivers of the pool
+
+            *Parameters*:
+                - **function**: The function to run, which gets the WebDriver
+                  as first argument.
+                - **args**, **kwargs**: The other arguments of the function.
+
+            *Returns*: The results and the errors, keyed by session id.
+        """
+        futures = {self.__executor.submit(function, browser, *args, **kwargs): browser.session_id for browser in self.__browsers}
+        results = {}
+        errors = {}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+        return results, errors
+
+    def install(self, xpiPath, timeout=5):
+        """
+            Install **ConsoleCapture** on all the WebDrivers of the pool
+
+            *Parameters*:
+                - **xpiPath**: The path to **ConsoleCapture** extension file.
+                - **timeout**: The default time (in seconds) to wait for **ConsoleCapture**.
+        """
+        return self.map(captureConsole, xpiPath, timeout)
+
+    def __call__(self, compact=False, lazy=False):
+        return self.map(lambda browser: browser.consoleCapture(compact, lazy))
+
+    def tail(self, compact=False, lazy=False):
+        """
+            Get the calls captured since the last call to ``tail()`` on all the WebDrivers
+        """
+        return self.map(lambda browser: browser.consoleCapture.tail(compact, lazy))
+
+    def drain(self, compact=False, lazy=False):
+        """
+            Get and clear the captures of all the WebDrivers
+        """
+        return self.map(lambda browser: browser.consoleCapture.drain(compact, lazy))
+
+    def clear(self):
+        """
+            Clear the captures of all the WebDrivers
+        """
+        return self.map(lambda browser: browser.consoleCapture.clear())
+
+    def configure(self, **options):
+        """
+            Change the capture settings of all the WebDrivers
+        """
+        return self.map(lambda browser: browser.consoleCapture.configure(**options))
+
+    def status(self):
+        """
+            Get the capture status of all the WebDrivers
+        """
+        return self.map(lambda browser: browser.consoleCapture.status())
+
+    def close(self):
+        """
+            Stop the threads of the pool
+
+            The WebDrivers are not closed.
+        """
+        self.__executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ConsoleCaptureCollector:
+    """
+        Collector for the calls pushed by **ConsoleCapture**
+
+        The collector runs a small HTTP server on the local host, to which
+        **ConsoleCapture** pushes the captured calls when
+        ``browser.consoleCapture.push`` is set to the collector URL::
+
+            with ConsoleCaptureCollector() as collector:
+                browser.consoleCapture.push = collector.url
+                for entry in collector:
+                    print(entry['callee'], entry['arguments'])
+
+        The pushed calls have the same keys as the calls returned by
+        ``browser.consoleCapture()``, and in addition the id of the tab
+        (``tab``) and the URL of the page (``url``) in which they were captured.
+        DOM elements are replaced by their type, as in ``'[object HTMLBodyElement]'``.
+        When ``coalesce`` is set, a call is pushed again (with the same ``seq``)
+        each time its ``count`` increases after it was pushed.
+
+        *Note*: Pushing does not involve WebDriver, so that it does not slow
+        down the tests.
+
+        *Parameters*:
+            - **callback**: A function called (in the server thread) with each pushed call, in order.
+            - **host**: The address on which the collector listens.
+            - **port**: The port on which the collector listens (``0`` chooses a free port).
+    """
+
+    __end = object()
+
+    def __init__(self, callback=None, host='127.0.0.1', port=0):
+        self.__callback = callback
+        self.__queue = queue.Queue()
+
+        collect = self.__collect
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send_response(204)
+                self.end_headers()
+                collect(json.loads(body))
+
+            def log_message(self, *args):
+                pass
+
+        # A single thread, so that the calls are collected in order:
+        self.__server = http.server.HTTPServer((host, port), Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def __collect(self, batch):
+        for entry in _decodeCapture(batch['entries']):
+            entry['tab'] = batch['tab']
+            entry['url'] = batch['url']
+            if self.__callback is not None:
+                self.__callback(entry)
+            self.__queue.put(entry)
+
+    @property
+    def url(self):
+        """
+            The URL to which **ConsoleCapture** must push the calls
+        """
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def get(self, timeout=None):
+        """
+            Get the next pushed call
+
+            *Parameters*:
+                - **timeout**: The maximum time to wait for a call (in seconds).
+
+            *Returns*: The next pushed call, or ``None`` if there is no call
+            before the timeout or if the collector is closed.
+        """
+        try:
+            entry = self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if entry is self.__end:
+            self.__queue.put(entry)
+            return None
+        return entry
+
+    def __iter__(self):
+        while True:
+            entry = self.__queue.get()
+            if entry is self.__end:
+                self.__queue.put(entry)
+                return
+            yield entry
+
+    def close(self):
+        """
+            Stop the collector
+
+            The iterations over the collector stop once all the already
+            pushed calls have been returned.
+        """
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__queue.put(self.__end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _openRecording(path, mode, compression, bufferSize=io.DEFAULT_BUFFER_SIZE):
+    if (compression == 'zstd') and (zstandard is None):
+        raise ImportError("zstd compression requires zstandard package")
+
+    if (mode == 'r'):
+        rawFile = open(path, 'rb')
+        if compression is None:
+            magic = rawFile.peek(4)[:4]
+            if magic.startswith(b'\x1f\x8b'):
+                compression = 'gzip'
+            elif (magic == b'\x28\xb5\x2f\xfd'):
+                compression = 'zstd'
+        if (compression == 'gzip'):
+            return rawFile, io.TextIOWrapper(gzip.GzipFile(fileobj=rawFile, mode='rb'), encoding='utf-8')
+        if (compression == 'zstd'):
+            return rawFile, io.TextIOWrapper(io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(rawFile, read_across_frames=True)), encoding='utf-8')
+        return rawFile, io.TextIOWrapper(rawFile, encoding='utf-8')
+
+    rawFile = open(path, 'ab', buffering=bufferSize)
+    if (compression == 'gzip'):
+        return rawFile, io.TextIOWrapper(gzip.GzipFile(fileobj=rawFile, mode='ab'), encoding='utf-8')
+    if (compression == 'zstd'):
+        return rawFile, io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(rawFile), encoding='utf-8')
+    return rawFile, io.TextIOWrapper(rawFile, encoding='utf-8')
+
+def _recordingPaths(path):
+    yield path
+    n = 1
+    while os.path.exists(f"{path}.{n}"):
+        yield f"{path}.{n}"
+        n = n + 1
+
+def _jsonDefault(value):
+    if isinstance(value, WebElement):
+        return value.id
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class ConsoleCaptureRecorder:
+    """
+        Recorder of the capture in a file
+
+        The recorder drains the capture at regular intervals in a background
+        thread and appends the calls to a NDJSON file (one JSON object per
+        line), optionally compressed. When the file becomes too big, the
+        recording continues in ``path.1``, then ``path.2``, etc::
+
+            with ConsoleCaptureRecorder(browser, 'capture.ndjson.gz', compression='gzip'):
+                ...
+            for entry in readRecording('capture.ndjson.gz'):
+                print(entry['callee'], entry['arguments'])
+
+        DOM elements are recorded as their WebDriver id.
+
+        *Note*: The recorder uses the WebDriver in its own thread. The capture
+        should not be drained or cleared by other threads while recording.
+
+        *Parameters*:
+            - **browser**: The Selenium WebDriver whose capture is recorded.
+            - **path**: The path to the recording file.
+            - **interval**: The interval between two drains of the capture (in seconds).
+            - **compression**: The compression of the file (``None``, ``'gzip'``
+              or ``'zstd'``, which requires ``zstandard`` package).
+            - **bufferSize**: The size of the write buffer (in bytes).
+            - **maxBytes**: The size after which the recording continues in a
+              new file (``0`` disables rotation).
+    """
+
+    def __init__(self, browser, path, interval=1, compression=None, bufferSize=65536, maxBytes=0):
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError(f"Unsupported compression: {compression}")
+
+        self.__browser = browser
+        self.__path = path
+        self.__interval = interval
+        self.__compression = compression
+        self.__bufferSize = bufferSize
+        self.__maxBytes = maxBytes
+        self.__index = 0
+        self.__rawFile = None
+        self.__file = None
+        self.__stopped = threading.Event()
+        self.__thread = None
+        self.error = None
+
+    def __open(self):
+        path = self.__path if (self.__index == 0) else f"{self.__path}.{self.__index}"
+        self.__rawFile, self.__file = _openRecording(path, 'w', self.__compression, self.__bufferSize)
+
+    def __close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__rawFile.close()
+            self.__file = None
+
+    def __record(self):
+        try:
+            capture = self.__browser.consoleCapture.execute_script("return console.capture.drain();")
+        except Exception as e:
+            self.error = e
+            return
+
+        for entry in capture:
+            self.__file.write(json.dumps(entry, default=_jsonDefault) + '\n')
+        if self.__maxBytes > 0:
+            # The text and compression layers buffer what is not yet in the file:
+            self.__file.flush()
+        if (self.__maxBytes > 0) and (self.__rawFile.tell() >= self.__maxBytes):
+            self.__close()
+            self.__index = self.__index + 1
+            self.__open()
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            self.__record()
+
+    def start(self):
+        """
+            Start recording
+
+            If the recording file already exists, the calls are appended to
+            the last file of the recording.
+        """
+        self.__index = len(list(_recordingPaths(self.__path))) - 1
+        self.__open()
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+            Stop recording
+
+            The capture is drained a last time and the file is closed.
+        """
+        self.__stopped.set()
+        self.__thread.join()
+        self.__record()
+        self.__close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+def readRecording(path, compression=None):
+    """
+        Read a recording made by ``ConsoleCaptureRecorder``
+
+        The calls are read lazily, one at a time, from the recording file and
+        the files continuing it (``path.1``, ``path.2``, etc).
+
+        *Parameters*:
+            - **path**: The path to the recording file.
+            - **compression**: The compression of the file (detected if ``None``).
+
+        *Returns*: An iterator over the recorded calls.
+    """
+    for filePath in _recordingPaths(path):
+        rawFile, recording = _openRecording(filePath, 'r', compression)
+        with rawFile, recording:
+            for line in recording:
+                if line.strip():
+                    yield _decodeCapture([json.loads(line)])[0]
+
+def captureConsole(browser, xpiPath, timeout=5):
     """
         Install **ConsoleCapture** on the given WebDriver
 
@@ -78,14 +1184,20 @@ def captureConsole(browser, xpiPath):
         After having called this function, you will be able to get the capture
         using ``browser.consoleCapture()``, clear it using
         ``del browser.consoleCapture`` and access the capture depth using
-        ``browser.consoleCapture.depth`` property.
+        ``browser.consoleCapture.depth`` property. The other methods and
+        settings of ``browser.consoleCapture`` are described in
+        ``ConsoleCaptureAccessor``. ``browser.asyncConsoleCapture`` provides
+        the same methods for ``asyncio`` (see ``AsyncConsoleCaptureAccessor``).
 
         *Note*: You should provide a non-``None`` profile when initializing the
         WebDriver, unless you use a signed extension.
 
+        *Note*: The timeout must be shorter than the WebDriver script timeout.
+
         *Parameters*:
             - **browser**: The Selenium WebDriver in which to install **ConsoleCapture**
             - **xpiPath**: The path to **ConsoleCapture** extension file.
+            - **timeout**: The default time (in seconds) to wait for **ConsoleCapture**.
     """
 
     if hasattr(browser, 'getConsoleCapture') and hasattr(browser, 'clearConsoleCapture'):
@@ -94,4 +1206,8 @@ def captureConsole(browser, xpiPath):
 
     print(browser.install_addon(xpiPath, True))
 
-    setattr(type(browser), 'consoleCapture', ConsoleCaptureDescriptor())
+    if not isinstance(inspect.getattr_static(browser, 'consoleCapture', None), ConsoleCaptureDescriptor):
+        setattr(type(browser), 'consoleCapture', ConsoleCaptureDescriptor(timeout))
+        setattr(type(browser), 'asyncConsoleCapture', AsyncConsoleCaptureDescriptor())
+    # The descriptor is shared by all the WebDrivers of the class:
+    browser.consoleCapture.timeout = timeout
@@ -18,7 +18,9 @@
 from selenium import webdriver
 from selenium.common import exceptions as selenium
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
 
+import asyncio
 import os
 import sys
 import time
@@ -28,7 +30,9 @@ sys.path.append(os.path.dirname(__file__))
 print(os.path.dirname(__file__))
 
 from PythonUtils.testdata import TestData
-from console_capture import captureConsole
+from console_capture import captureConsole, readRecording
+from console_capture import ConsoleCaptureCollector, ConsoleCapturePool, ConsoleCaptureRecorder
+from console_capture import ConsoleCaptureEntries
 
 class TestCase(type):
     __testCaseList = []
@@ -453,6 +457,764 @@ class ClickFileTest(BaseTest, metaclass=TestCase):
     def action(self, *args, **kwargs):
         self.browser.find_element(By.ID, 'test').click()
 
+class ReferenceTest(BrowserTestCase, metaclass=TestCase):
+    def testCycle(self):
+        self.getIndex(title='cycle')
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('var a = {x: 1}; a.self = a; console.log(a);')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        a = capture[0]['arguments'][0]
+        self.assertEqual(a['x'], 1)
+        self.assertIs(a['self'], a)
+
+    def testShared(self):
+        self.getIndex(title='shared')
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('var s = {k: [1, 2]}; console.log([s, s], s);')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        a, s = capture[0]['arguments']
+        self.assertEqual(s, {'k': [1, 2]})
+        self.assertIs(a[0], s)
+        self.assertIs(a[1], s)
+
+    def testEscape(self):
+        self.getIndex(title='escape')
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('var s = {$ref: [0]}; console.log({$ref: "#/x"}, s, [s]);')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        r, s, a = capture[0]['arguments']
+        self.assertEqual(r, {'$ref': '#/x'})
+        self.assertEqual(s, {'$ref': [0]})
+        self.assertIs(a[0], s)
+
+    def testPrimitive(self):
+        self.getIndex(title='primitive')
+        self.browser.consoleCapture.depth = 1
+        del self.browser.consoleCapture
+
+        try:
+            self.browser.execute_script('console.log(10n);')
+            capture = self.browser.consoleCapture()
+        finally:
+            self.browser.consoleCapture.depth = 0
+        self.assertEqual(len(capture), 1)
+        self.assertEqual(capture[0]['arguments'], [{'typeName': 'BigInt'}])
+
+class CompactTest(BrowserTestCase, metaclass=TestCase):
+    def testCompact(self):
+        self.getIndex('''<script type="text/javascript">
+        function fun() {
+            console.log("1", {a: [1, 2]});
+            console.warn("2");
+        }
+    </script>''', title='compact')
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('fun(); console.error("3");')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 3)
+        self.assertEqual(self.browser.consoleCapture(compact=True), capture)
+        self.assertEqual(self.browser.consoleCapture.drain(compact=True), capture)
+
+class FramesTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        os.remove(os.path.join(self.__class__.baseDir, 'test/test_frame.html'))
+        super().tearDown()
+
+    def testFrames(self):
+        frameFilePath = os.path.join(self.__class__.baseDir, 'test/test_frame.html')
+        with open(frameFilePath, 'w') as frameFile:
+            frameFile.write(self.__class__.index.format(' <frame>', '<script>setTimeout(() => console.log("frame"), 200);</script>'))
+
+        self.getIndex('<iframe src="test_frame.html"></iframe>', title='frames')
+        WebDriverWait(self.browser, 5).until(lambda b: len(b.consoleCapture.frames()) > 0)
+        self.browser.execute_script('console.log("top");')
+
+        capture = self.browser.consoleCapture.frames()
+        self.assertEqual([c['arguments'] for c in capture], [['frame'], ['top']])
+        self.assertEqual([c['frameUrl'] for c in capture], ['file://' + frameFilePath, self.url])
+        # The top frame has id 0:
+        self.assertGreater(capture[0]['frame'], 0)
+        self.assertEqual(capture[1]['frame'], 0)
+        self.assertEqual([c['arguments'] for c in self.browser.consoleCapture()], [['top']])
+
+class LazyTest(BrowserTestCase, metaclass=TestCase):
+    def testLazy(self):
+        self.getIndex('''<script type="text/javascript">
+        function fun() {
+            var obj = {a: 1};
+            console.log("1", {b: [obj, obj]});
+            console.warn(document.body);
+        }
+    </script>''', title='lazy')
+        del self.browser.consoleCapture
+        self.browser.execute_script('fun();')
+
+        capture = self.browser.consoleCapture(lazy=True)
+        self.assertIsInstance(capture, ConsoleCaptureEntries)
+        self.assertEqual(len(capture), 2)
+        self.assertEqual([c['callee'] for c in capture], ['log', 'warn'])
+        self.assertEqual(capture[0]['arguments'], ['1', {'b': [{'a': 1}, {'a': 1}]}])
+        self.assertEqual(capture[1]['arguments'], ['[object HTMLBodyElement]'])
+        self.assertEqual(capture[0]['caller'], 'fun')
+        self.assertNotIn('count', capture[0])
+
+        expected = self.browser.consoleCapture()
+        self.assertEqual(dict(capture[0]), expected[0])
+        self.assertEqual(capture.columns(['callee', 'lineNumber']), {
+            'callee': ['log', 'warn'],
+            'lineNumber': [e['lineNumber'] for e in expected],
+        })
+
+        self.assertEqual(len(self.browser.consoleCapture.drain(lazy=True)), 2)
+        self.assertEqual(len(self.browser.consoleCapture(lazy=True)), 0)
+
+class QueryTest(BrowserTestCase, metaclass=TestCase):
+    def setUp(self):
+        super().setUp()
+        self.getIndex(title='query')
+        del self.browser.consoleCapture
+        self.browser.execute_script('for (var i = 0; i < 10; i++) console[(i % 3 == 0) ? "error" : "log"](i);')
+
+    @TestData([
+        {'params': {},                                   'result': list(range(10))},
+        {'params': {'callee': 'error'},                  'result': [0, 3, 6, 9]   },
+        {'params': {'callee': ['error', 'warn']},        'result': [0, 3, 6, 9]   },
+        {'params': {'callee': 'log', 'limit': 3},        'result': [1, 2, 4]      },
+        {'params': {'fileName': r'test_index\.html$'},   'result': list(range(10))},
+        {'params': {'fileName': r'test_script\.js$'},    'result': []             },
+    ])
+    def testQuery(self, params, result):
+        capture = self.browser.consoleCapture.query(**params)
+        self.assertEqual([c['arguments'][0] for c in capture], result)
+
+    def testTime(self):
+        capture = self.browser.consoleCapture()
+        time.sleep(0.1)
+        self.browser.execute_script('console.error("late");')
+
+        self.assertEqual(self.browser.consoleCapture.query(until=capture[-1]['time']), capture)
+        late = self.browser.consoleCapture.query(since=capture[-1]['time'] + 50)
+        self.assertEqual([c['arguments'] for c in late], [['late']])
+
+    def testInvalid(self):
+        with self.assertRaises(ValueError):
+            self.browser.consoleCapture.query(fileName='(')
+        with self.assertRaises(TypeError):
+            self.browser.consoleCapture.query(limit='1')
+
+class TailTest(BrowserTestCase, metaclass=TestCase):
+    def testTail(self):
+        self.getIndex(title='tail')
+        self.assertEqual(self.browser.consoleCapture.tail(), [])
+
+        self.browser.execute_script('console.log("1"); console.log("2");')
+        capture = self.browser.consoleCapture.tail()
+        self.assertEqual([c['arguments'] for c in capture], [['1'], ['2']])
+
+        self.browser.execute_script('console.log("3");')
+        capture = self.browser.consoleCapture.tail()
+        self.assertEqual([c['arguments'] for c in capture], [['3']])
+
+        self.assertEqual(self.browser.consoleCapture.tail(), [])
+        self.assertEqual(len(self.browser.consoleCapture()), 3)
+
+    def testNavigation(self):
+        self.getIndex(title='tail')
+        self.browser.execute_script('console.log("1"); console.log("2");')
+        self.browser.consoleCapture.tail()
+
+        self.getIndex(title='navigation')
+        self.browser.execute_script('console.log("3");')
+        capture = self.browser.consoleCapture.tail()
+        self.assertEqual([c['arguments'] for c in capture], [['3']])
+
+class DrainTest(BrowserTestCase, metaclass=TestCase):
+    def testDrain(self):
+        self.getIndex(title='drain')
+        del self.browser.consoleCapture
+        self.assertEqual(self.browser.consoleCapture.drain(), [])
+
+        self.browser.execute_script('console.log("1"); console.warn("2");')
+        capture = self.browser.consoleCapture.drain()
+        self.assertEqual([c['callee'] for c in capture], ['log', 'warn'])
+        self.assertEqual([c['arguments'] for c in capture], [['1'], ['2']])
+
+        self.assertEqual(self.browser.consoleCapture(), [])
+        self.assertEqual(self.browser.consoleCapture.drain(), [])
+
+class CapacityTest(BrowserTestCase, metaclass=TestCase):
+    def setUp(self):
+        super().setUp()
+        self.getIndex(title='capacity')
+        self.browser.consoleCapture.capacity = 3
+        self.dropped = self.browser.consoleCapture.dropped
+
+    def tearDown(self):
+        self.browser.consoleCapture.capacity = 0
+        self.browser.consoleCapture.overflow = 'oldest'
+        super().tearDown()
+
+    @TestData([
+        {'overflow': 'oldest', 'result': [['2'], ['3'], ['4']]},
+        {'overflow': 'newest', 'result': [['0'], ['1'], ['2']]},
+        {'overflow': 'stop',   'result': [['0'], ['1'], ['2']]},
+    ])
+    def testOverflow(self, overflow, result):
+        self.browser.consoleCapture.overflow = overflow
+        self.assertEqual(self.browser.consoleCapture.overflow, overflow)
+
+        self.browser.execute_script('for (var i = 0; i < 5; i++) console.log(String(i));')
+        self.assertEqual([c['arguments'] for c in self.browser.consoleCapture()], result)
+        self.assertEqual(self.browser.consoleCapture.dropped, self.dropped + 2)
+
+    def testStop(self):
+        self.browser.consoleCapture.overflow = 'stop'
+
+        self.browser.execute_script('for (var i = 0; i < 5; i++) console.log(String(i));')
+        del self.browser.consoleCapture
+        self.browser.execute_script('console.log("5");')
+        self.assertEqual([c['arguments'] for c in self.browser.consoleCapture()], [['5']])
+
+    def testDropped(self):
+        with self.assertRaises(AttributeError):
+            self.browser.consoleCapture.dropped = 0
+
+class CoalesceTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.coalesce = False
+        super().tearDown()
+
+    @TestData([True, 1000])
+    def testCoalesce(self, coalesce):
+        self.getIndex(title='coalesce')
+        self.browser.consoleCapture.coalesce = coalesce
+        self.assertEqual(self.browser.consoleCapture.coalesce, coalesce)
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('for (var i = 0; i < 5; i++) console.log("1", {a: 1}); console.log("2"); console.log("1", {a: 1});')
+        capture = self.browser.consoleCapture()
+        self.assertEqual([c['arguments'] for c in capture], [['1', {'a': 1}], ['2'], ['1', {'a': 1}]])
+        self.assertEqual([c['count'] for c in capture], [5, 1, 1])
+        self.assertLessEqual(capture[0]['time'], capture[0]['lastTime'])
+
+    def testWindow(self):
+        self.getIndex(title='window')
+        self.browser.consoleCapture.coalesce = 100
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('console.log("1"); console.log("1"); setTimeout(() => console.log("1"), 300);')
+        time.sleep(0.5)
+        self.assertEqual([c['count'] for c in self.browser.consoleCapture()], [2, 1])
+
+class LimitsTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.configure(maxString=0, maxArray=0, maxKeys=0, maxEntryBytes=0)
+        super().tearDown()
+
+    @TestData([
+        {'limits': {'maxString': 3},  'arguments': ['abcdef'],           'result': [{'$truncated': 'String', 'size': 6, 'value': 'abc'}]},
+        {'limits': {'maxArray': 2},   'arguments': [[1, 2, 3, 4]],       'result': [[1, 2, {'$truncated': 'Array', 'size': 4}]]},
+        {'limits': {'maxKeys': 1},    'arguments': [{'a': 1, 'b': 2}],   'result': [{'a': 1, '$truncated': 2}]},
+        {'limits': {'maxEntryBytes': 8}, 'arguments': ['abc', 'defghijk', 'l'],
+         'result': ['abc', {'$truncated': 'String', 'size': 8, 'value': 'd'}, {'$truncated': 'Array', 'size': 3}]},
+        {'limits': {'maxString': 10, 'maxArray': 10}, 'arguments': ['abc', [1, 2]], 'result': ['abc', [1, 2]]},
+    ])
+    def testLimits(self, limits, arguments, result):
+        self.getIndex(title='limits')
+        status = self.browser.consoleCapture.configure(**limits)
+        for name, limit in limits.items():
+            self.assertEqual(status[name], limit)
+            self.assertEqual(getattr(self.browser.consoleCapture, name), limit)
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('console.log(...arguments[0]);', arguments)
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        self.assertEqual(capture[0]['arguments'], result)
+
+class DeferTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.defer = False
+        super().tearDown()
+
+    @TestData([
+        {'defer': False,  'result': 1},
+        {'defer': 'get',  'result': 2},
+    ])
+    def testDefer(self, defer, result):
+        self.getIndex('''<script type="text/javascript">
+        function fun() {
+            var obj = {value: 1};
+            console.log(obj);
+            obj.value = 2;
+        }
+    </script>''', title='defer')
+        self.browser.consoleCapture.defer = defer
+        self.assertEqual(self.browser.consoleCapture.defer, defer)
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('fun();')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        self.assertEqual(capture[0]['arguments'], [{'value': result}])
+
+    def testIdle(self):
+        self.getIndex(title='idle')
+        self.browser.consoleCapture.defer = 'idle'
+        del self.browser.consoleCapture
+
+        # The capture serializes the calls in an idle callback requested before the one
+        # of the page, so the values must be captured before they are modified:
+        self.browser.execute_async_script('''
+            var done = arguments[arguments.length - 1];
+            var objs = [];
+            for (var i = 0; i < 10; i++) {
+                objs.push({index: i});
+                console.log(objs[i]);
+            }
+            requestIdleCallback(() => {
+                objs.forEach((obj) => obj.index = -1);
+                done();
+            });
+        ''')
+        self.assertEqual([c['arguments'] for c in self.browser.consoleCapture()], [[{'index': i}] for i in range(10)])
+
+class CountersTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.mode = 'entries'
+        super().tearDown()
+
+    def testCounters(self):
+        self.getIndex('''<script type="text/javascript">
+        function fun() {
+            for (var i = 0; i < 5; i++)
+                console.log(i);
+            console.warn("warn");
+        }
+    </script>''', title='counters')
+        self.browser.consoleCapture.mode = 'counters'
+        self.assertEqual(self.browser.consoleCapture.mode, 'counters')
+        del self.browser.consoleCapture
+
+        beforeTime = time.time()
+        self.browser.execute_script('fun(); fun();')
+        afterTime = time.time()
+        self.assertEqual(self.browser.consoleCapture(), [])
+
+        counters = sorted(self.browser.consoleCapture.counters(times=True), key=lambda c: c['callee'])
+        self.assertEqual([c['callee'] for c in counters], ['log', 'warn'])
+        self.assertEqual([c['count'] for c in counters], [10, 2])
+        self.assertEqual([c['lineNumber'] for c in counters], ['11', '12'])
+        for c in counters:
+            self.assertEqual(c['caller'], 'fun')
+            self.assertTrue(beforeTime - 0.001 <= c['first']/1000 <= c['last']/1000 <= afterTime + 0.001)
+
+        del self.browser.consoleCapture
+        self.assertEqual(self.browser.consoleCapture.counters(), [])
+
+class StackTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.stack = 'full'
+        super().tearDown()
+
+    @TestData(['lazy', 'full'])
+    def testStack(self, stack):
+        self.getIndex('''<script type="text/javascript">
+        function fun() {
+            console.log("OK");
+        }
+    </script>''', title=stack)
+        self.browser.consoleCapture.stack = stack
+        self.assertEqual(self.browser.consoleCapture.stack, stack)
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('fun();')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        self.assertEqual(capture[0]['caller'], 'fun')
+        self.assertEqual(capture[0]['fileName'], self.url)
+        self.assertEqual(capture[0]['lineNumber'], '10')
+        self.assertEqual(capture[0]['columnNumber'], '21')
+        self.assertNotIn('frame', capture[0])
+
+    def testOff(self):
+        self.getIndex(title='off')
+        self.browser.consoleCapture.stack = 'off'
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('console.log("OK");')
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        self.assertEqual(capture[0]['arguments'], ['OK'])
+        for key in ['caller', 'fileName', 'lineNumber', 'columnNumber']:
+            self.assertNotIn(key, capture[0])
+
+class ConfigureTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.configure(depth=0, capacity=0, overflow='oldest')
+        super().tearDown()
+
+    def testConfigure(self):
+        self.getIndex(title='configure')
+        status = self.browser.consoleCapture.configure(depth=2, capacity=10, overflow='newest')
+        self.assertEqual(status['depth'], 2)
+        self.assertEqual(status['capacity'], 10)
+        self.assertEqual(status['overflow'], 'newest')
+        self.assertEqual(self.browser.consoleCapture.depth, 2)
+
+    def testStatus(self):
+        self.getIndex(title='status')
+        del self.browser.consoleCapture
+        self.browser.execute_script('console.log("1"); console.log("2");')
+
+        status = self.browser.consoleCapture.status()
+        self.assertEqual(status['length'], 2)
+        self.assertGreater(status['bytes'], 0)
+        self.assertEqual(status['dropped'], 0)
+        self.assertEqual(status['depth'], 0)
+
+    @unittest.skip("Marionnette does not decode well the javascript errors")
+    def testInvalid(self):
+        self.getIndex(title='invalid')
+        with self.assertRaises(NameError):
+            self.browser.consoleCapture.configure(invalid=1)
+        with self.assertRaises(TypeError):
+            self.browser.consoleCapture.configure(dropped=1)
+        with self.assertRaises(TypeError):
+            self.browser.consoleCapture.configure(depth='1')
+        with self.assertRaises(ValueError):
+            self.browser.consoleCapture.configure(depth=-1)
+
+class ReadyTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.get(self.url)
+        self.browser.consoleCapture.timeout = 5
+        super().tearDown()
+
+    def testReady(self):
+        self.getIndex(title='ready')
+        beforeTime = time.time()
+        self.assertEqual(self.browser.consoleCapture(), [])
+        self.assertLess(time.time() - beforeTime, 1)
+
+    def testTimeout(self):
+        self.getIndex(title='timeout')
+        self.browser.consoleCapture.timeout = 0.2
+        self.browser.get('about:blank')
+
+        beforeTime = time.time()
+        with self.assertRaises(RuntimeError):
+            self.browser.consoleCapture()
+        self.assertLess(time.time() - beforeTime, 1)
+
+class FiltersTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.filters = None
+        super().tearDown()
+
+    @TestData([
+        {'filters': {'allow': ['error', 'warn']},         'result': [['2'], ['3']]       },
+        {'filters': {'deny': ['log']},                    'result': [['2'], ['3']]       },
+        {'filters': {'prefix': '3'},                      'result': [['3']]              },
+        {'filters': {'fileName': r'test_index\.html$'},   'result': [['1'], ['2'], ['3']]},
+        {'filters': {'fileName': r'test_script\.js$'},    'result': []                   },
+    ])
+    def testFilters(self, filters, result):
+        self.getIndex('''<script type="text/javascript">
+        function fun() {
+            console.log("1");
+            console.warn("2");
+            console.error("3");
+        }
+    </script>''', title='filters')
+        self.browser.consoleCapture.filters = filters
+        self.assertEqual(self.browser.consoleCapture.filters, filters)
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('fun();')
+        self.assertEqual([c['arguments'] for c in self.browser.consoleCapture()], result)
+
+class TargetsTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.targets = []
+        super().tearDown()
+
+    @TestData([
+        {'targets': ['app.load'],       'callee': 'app.load'      },
+        {'targets': ['app'],            'callee': 'app.load'      },
+        {'targets': ['App.prototype'],  'callee': 'App.prototype.load'},
+    ])
+    def testTargets(self, targets, callee):
+        self.getIndex('''<script type="text/javascript">
+        function App() {}
+        App.prototype.load = function(n) {
+            var start = Date.now();
+            while (Date.now() - start < 10);
+            return 2 * n;
+        };
+        var app = new App();
+        app.load = App.prototype.load;
+        app.Model = class {
+            value() { return 3; }
+        };
+    </script>''', title='targets')
+        self.browser.consoleCapture.targets = targets
+        self.assertEqual(self.browser.consoleCapture.targets, targets)
+        del self.browser.consoleCapture
+
+        if callee.startswith('App'):
+            self.assertEqual(self.browser.execute_script('return (new App()).load(1);'), 2)
+        else:
+            self.assertEqual(self.browser.execute_script('return app.load(1);'), 2)
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        self.assertEqual(capture[0]['callee'], callee)
+        self.assertEqual(capture[0]['arguments'], [1])
+        self.assertGreaterEqual(capture[0]['duration'], 10)
+        self.assertGreater(capture[0]['start'], 0)
+        # Constructors are not captured:
+        self.assertEqual(self.browser.execute_script('return (new app.Model()).value();'), 3)
+        self.assertEqual(len(self.browser.consoleCapture()), 1)
+        # The capture does not change the result of the calls:
+        if not callee.startswith('App'):
+            self.browser.consoleCapture.stats(reset=True)
+            self.assertIs(self.browser.execute_script('return isNaN(app.load({get a() { throw new Error("getter"); }}));'), True)
+            self.assertEqual(self.browser.consoleCapture.stats()['failed'], 1)
+
+        self.browser.consoleCapture.targets = []
+        del self.browser.consoleCapture
+        self.browser.execute_script('app.load(1); (new App()).load(1);')
+        self.assertEqual(self.browser.consoleCapture(), [])
+
+    def testAsync(self):
+        self.getIndex('''<script type="text/javascript">
+        var app = {
+            wait: function(ms) {
+                return new Promise((resolve) => setTimeout(() => resolve(ms), ms));
+            },
+        };
+    </script>''', title='targets')
+        self.browser.consoleCapture.targets = ['app.wait']
+        del self.browser.consoleCapture
+
+        self.assertEqual(self.browser.execute_async_script('app.wait(50).then(arguments[0]);'), 50)
+        capture = self.browser.consoleCapture()
+        self.assertEqual(len(capture), 1)
+        self.assertGreaterEqual(capture[0]['duration'], 50)
+
+class StatsTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.filters = None
+        super().tearDown()
+
+    def testStats(self):
+        self.getIndex(title='stats')
+        self.browser.consoleCapture.stats(reset=True)
+        self.browser.consoleCapture.filters = {'deny': ['warn']}
+        del self.browser.consoleCapture
+
+        self.browser.execute_script('for (var i = 0; i < 10; i++) console.log(i, {a: [i]}); console.warn("denied");')
+        stats = self.browser.consoleCapture.stats(reset=True)
+        self.assertEqual(stats['calls'], 11)
+        self.assertEqual(stats['recorded'], 10)
+        self.assertEqual(stats['entries'], 10)
+        self.assertGreater(stats['bytes'], 0)
+        for timer in [stats['clean'], stats['stack']]:
+            self.assertEqual(timer['count'], 10)
+            self.assertEqual(sum(timer['histogram']), 10)
+            self.assertEqual(len(timer['histogram']), len(stats['bounds']) + 1)
+            self.assertGreaterEqual(timer['total'], timer['max'])
+
+        stats = self.browser.consoleCapture.stats()
+        self.assertEqual(stats['calls'], 0)
+        self.assertEqual(stats['clean']['count'], 0)
+        self.assertEqual(stats['entries'], 10)
+
+class HistoryTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        self.browser.consoleCapture.history(clear=True)
+        self.browser.consoleCapture.persist = 0
+        super().tearDown()
+
+    def testHistory(self):
+        self.getIndex(title='history')
+        self.browser.consoleCapture.persist = 3
+        self.assertEqual(self.browser.consoleCapture.persist, 3)
+        self.browser.consoleCapture.history(clear=True)
+
+        self.browser.execute_script('console.log("1");')
+        self.getIndex(title='navigation')
+        self.browser.execute_script('console.log("2"); console.log("3"); console.log("4");')
+
+        history = self.browser.consoleCapture.history()
+        self.assertEqual([e['arguments'] for e in history], [['2'], ['3'], ['4']])
+        self.browser.execute_script('console.log("5");')
+        self.assertEqual([e['arguments'] for e in self.browser.consoleCapture.history(clear=True)], [['3'], ['4'], ['5']])
+        self.assertEqual(self.browser.consoleCapture.history(), [])
+
+    def testUrl(self):
+        self.getIndex(title='history')
+        self.browser.consoleCapture.persist = 10
+        self.browser.consoleCapture.history(clear=True)
+
+        self.browser.execute_script('console.log("1");')
+        self.browser.get(self.url + '?navigation')
+        self.browser.execute_script('console.log("2");')
+
+        history = self.browser.consoleCapture.history()
+        self.assertEqual([e['arguments'] for e in history], [['1'], ['2']])
+        self.assertEqual([e['url'] for e in history], [self.url, self.url + '?navigation'])
+
+    def testCoalesce(self):
+        self.getIndex(title='history')
+        self.browser.consoleCapture.persist = 10
+        self.browser.consoleCapture.coalesce = True
+        self.browser.consoleCapture.history(clear=True)
+
+        try:
+            # The calls after the first batch update the count of the kept call:
+            self.browser.execute_script('function log() { console.log("1"); } log(); setTimeout(log, 300);')
+            time.sleep(0.5)
+            self.assertEqual([e['count'] for e in self.browser.consoleCapture.history()], [2])
+        finally:
+            self.browser.consoleCapture.coalesce = False
+
+class PushTest(BrowserTestCase, metaclass=TestCase):
+    def testPush(self):
+        with ConsoleCaptureCollector() as collector:
+            self.getIndex(title='push')
+            self.browser.consoleCapture.push = collector.url
+            self.assertEqual(self.browser.consoleCapture.push, collector.url)
+
+            self.browser.execute_script('console.log("1"); console.warn("2");')
+            entries = [collector.get(5), collector.get(5)]
+            self.assertEqual([e['callee'] for e in entries], ['log', 'warn'])
+            self.assertEqual([e['arguments'] for e in entries], [['1'], ['2']])
+            self.assertEqual([e['url'] for e in entries], [self.url]*2)
+
+            self.browser.consoleCapture.push = None
+            self.browser.execute_script('console.log("3");')
+            self.assertIsNone(collector.get(0.5))
+
+    def testCoalesce(self):
+        with ConsoleCaptureCollector() as collector:
+            self.getIndex(title='push')
+            self.browser.consoleCapture.push = collector.url
+            self.browser.consoleCapture.coalesce = True
+            try:
+                self.browser.execute_script('function log() { console.log("1"); } log(); log(); setTimeout(log, 300);')
+                entries = [collector.get(5), collector.get(5)]
+                # The coalesced call is pushed again with its new count:
+                self.assertEqual([e['seq'] for e in entries], [0, 0])
+                self.assertEqual([e['count'] for e in entries], [2, 3])
+            finally:
+                self.browser.consoleCapture.coalesce = False
+                self.browser.consoleCapture.push = None
+
+class AsyncTest(BrowserTestCase, metaclass=TestCase):
+    def testAsync(self):
+        async def run():
+            await self.browser.asyncConsoleCapture.setDepth(1)
+            self.assertEqual(await self.browser.asyncConsoleCapture.getDepth(), 1)
+            await self.browser.asyncConsoleCapture.setDepth(0)
+
+            await self.browser.asyncConsoleCapture.clear()
+            self.assertEqual(await self.browser.asyncConsoleCapture(), [])
+            self.browser.execute_script('console.log("1"); console.log("2");')
+            capture = await self.browser.asyncConsoleCapture.drain()
+            self.assertEqual([c['arguments'] for c in capture], [['1'], ['2']])
+            self.assertEqual(await self.browser.asyncConsoleCapture(), [])
+
+        self.getIndex(title='async')
+        asyncio.run(run())
+
+    def testStream(self):
+        async def run():
+            entries = []
+            await self.browser.asyncConsoleCapture.tail()
+            self.browser.execute_script('setTimeout(() => console.log("1"), 100); setTimeout(() => console.log("2"), 300);')
+            async for entry in self.browser.asyncConsoleCapture.stream():
+                entries.append(entry['arguments'])
+                if len(entries) == 2:
+                    break
+            return entries
+
+        self.getIndex(title='stream')
+        self.assertEqual(asyncio.run(asyncio.wait_for(run(), 5)), [['1'], ['2']])
+
+    def testLoops(self):
+        async def run():
+            capture = self.browser.asyncConsoleCapture
+            return await asyncio.gather(capture(), capture.drain(), capture.tail())
+
+        self.getIndex(title='loops')
+        # The concurrent calls are serialized in each event loop:
+        self.assertEqual(asyncio.run(run()), [[], [], []])
+        self.assertEqual(asyncio.run(run()), [[], [], []])
+
+class RecorderTest(BrowserTestCase, metaclass=TestCase):
+    def tearDown(self):
+        recordingPath = os.path.join(self.__class__.baseDir, 'test/test_recording.ndjson')
+        for path in [recordingPath] + [f"{recordingPath}.{n}" for n in range(1, 10)]:
+            if os.path.exists(path):
+                os.remove(path)
+        super().tearDown()
+
+    @TestData([None, 'gzip'])
+    def testRecorder(self, compression):
+        recordingPath = os.path.join(self.__class__.baseDir, 'test/test_recording.ndjson')
+        self.getIndex(title='recorder')
+        del self.browser.consoleCapture
+
+        with ConsoleCaptureRecorder(self.browser, recordingPath, interval=0.1, compression=compression, maxBytes=1024):
+            for i in range(20):
+                # Random data, so that the compressed recording also rotates:
+                self.browser.execute_script(f'console.log({i}, "{os.urandom(100).hex()}");')
+                time.sleep(0.02)
+        self.assertEqual(self.browser.consoleCapture(), [])
+        self.assertTrue(os.path.exists(f"{recordingPath}.1"))
+
+        entries = list(readRecording(recordingPath))
+        self.assertEqual([e['arguments'][0] for e in entries], list(range(20)))
+
+class PoolTest(BrowserTestCase, metaclass=TestCase):
+    def testPool(self):
+        other = webdriver.Firefox()
+        try:
+            with ConsoleCapturePool([other]) as pool:
+                results, errors = pool.install(os.path.join(self.__class__.baseDir, 'dist/console_capture.xpi'), timeout=3)
+                self.assertEqual(list(results.keys()), [other.session_id])
+                self.assertEqual(errors, {})
+                self.assertEqual(other.consoleCapture.timeout, 3)
+                self.assertEqual(self.browser.consoleCapture.timeout, 5)
+
+            with ConsoleCapturePool([self.browser, other], workers=2) as pool:
+                self.getIndex(title='pool')
+                other.get(self.url)
+                pool.clear()
+                self.browser.execute_script('console.log("1");')
+                other.execute_script('console.log("2");')
+
+                results, errors = pool.drain()
+                self.assertEqual(errors, {})
+                self.assertEqual([c['arguments'] for c in results[self.browser.session_id]], [['1']])
+                self.assertEqual([c['arguments'] for c in results[other.session_id]], [['2']])
+
+                other.get('about:blank')
+                other.consoleCapture.timeout = 0.2
+                results, errors = pool.status()
+                self.assertIn(self.browser.session_id, results)
+                self.assertIsInstance(errors[other.session_id], RuntimeError)
+        finally:
+            other.quit()
+
 class DepthTest(BrowserTestCase, metaclass=TestCase):
     @TestData([1, 10])
     def testSetDepth(self, depth):